@@ -6,7 +6,13 @@ pymanip CLI interface
 
 from pathlib import Path
 from argparse import ArgumentParser
-from pymanip.util.session import manip_info, check_hdf, rebuild_from_dat
+from pymanip.util.session import (
+    manip_info,
+    check_hdf,
+    rebuild_from_dat,
+    compact_session,
+    parse_duration,
+)
 from pymanip.util.gpib import scanGpib
 from pymanip.util.video import preview_pco, preview_avt, preview_andor
 
@@ -54,6 +60,41 @@ parser_info.add_argument(
     "-p", "--plot", help="plot the specified variable.", metavar="varname"
 )
 
+# Create parser for "compact"
+parser_compact = subparsers.add_parser(
+    "compact", help="reduces the size of an asynchroneous session database"
+)
+parser_compact.add_argument(
+    "sessionName", help="name of the session to compact", metavar="session_name"
+)
+parser_compact.add_argument(
+    "-a",
+    "--max-age",
+    help="replace log values older than age (e.g. 3600, 12h, 30d) by bucket means",
+    metavar="age",
+    type=parse_duration,
+    default=None,
+)
+parser_compact.add_argument(
+    "-b",
+    "--bucket",
+    help="bucket duration for old log values (default 60s)",
+    metavar="duration",
+    type=parse_duration,
+    default=60.0,
+)
+parser_compact.add_argument(
+    "-k",
+    "--keep-datasets",
+    help="keep only the N latest datasets of each name",
+    metavar="N",
+    type=int,
+    default=None,
+)
+parser_compact.add_argument(
+    "--no-vacuum", action="store_true", help="do not rebuild the database file"
+)
+
 # Create parser for "list_instruments"
 parser_list_inst = subparsers.add_parser(
     "list_instruments", help="List supported instruments"
@@ -236,6 +277,14 @@ args = parser.parse_args()
 
 if args.command == "info":
     manip_info(args.sessionName, args.quiet, args.line, args.plot)
+elif args.command == "compact":
+    compact_session(
+        args.sessionName,
+        args.max_age,
+        args.bucket,
+        args.keep_datasets,
+        not args.no_vacuum,
+    )
 elif args.command == "list_instruments":
     import pymanip
 
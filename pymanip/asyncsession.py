@@ -9,17 +9,23 @@ import signal
 import time
 import sys
 import os.path
-import pickle
+import itertools
+import struct
+import zlib
 import warnings
+import threading
+import functools
+import queue
+import multiprocessing
 from pprint import pprint
 
-import sqlite3
 from datetime import datetime
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.cbook import mplDeprecation as MatplotlibDeprecationWarning
 
 import asyncio
+import aiohttp
 from aiohttp import web
 import aiohttp_jinja2
 import jinja2
@@ -36,146 +42,659 @@ except ModuleNotFoundError:
     pass
 
 from pymanip.mytime import dateformat
+from pymanip.storage import (
+    SQLiteBackend,
+    _real,
+    _is_plain_array,
+    _encode_dataset,
+    _decode_dataset,
+    _parse_array_header,
+    _ARRAY_COMPRESSORS,
+)
+
+__all__ = ["AsyncSession", "IngestionClient"]
+
+# Journal records: kind, length and CRC32 of the payload, then the payload
+# made of float64 timestamps and values, and length-prefixed strings
+_JOURNAL_MAGIC = b"PMJ2"
+_JOURNAL_RECORD = struct.Struct("<cII")
+_JOURNAL_FLOAT = struct.Struct("<d")
+_JOURNAL_LENGTH = struct.Struct("<I")
+# Binary format of the web API for timestamps and values: magic, number of
+# points, then the little-endian float64 timestamps and values. The batch
+# endpoint returns a length-prefixed name and columns block per variable.
+_COLUMNS_MEDIA_TYPE = "application/x-pymanip-columns"
+_COLUMNS_HEADER = struct.Struct("<4sI")
+_COLUMNS_MAGIC = b"PMC1"
+
+
+def _pack_bytes(data):
+    return _JOURNAL_LENGTH.pack(len(data)) + data
+
+
+def _unpack_bytes(payload, pos):
+    length, = _JOURNAL_LENGTH.unpack_from(payload, pos)
+    pos += _JOURNAL_LENGTH.size
+    return payload[pos : pos + length], pos + length
+
+
+def _pack_value(val):
+    """
+    Encodes a logged value for the journal: a float64 (b"f"), None (b"n"),
+    or length-prefixed text (b"s") or bytes (b"b")
+    """
+    if val is None:
+        return b"n"
+    if isinstance(val, float):
+        return b"f" + _JOURNAL_FLOAT.pack(val)
+    if isinstance(val, str):
+        return b"s" + _pack_bytes(val.encode("utf-8"))
+    if isinstance(val, bytes):
+        return b"b" + _pack_bytes(val)
+    raise TypeError("Cannot log values of type {:}".format(type(val).__name__))
+
+
+def _unpack_value(payload, pos):
+    kind = payload[pos : pos + 1]
+    pos += 1
+    if kind == b"n":
+        return None, pos
+    if kind == b"f":
+        val, = _JOURNAL_FLOAT.unpack_from(payload, pos)
+        return val, pos + _JOURNAL_FLOAT.size
+    data, pos = _unpack_bytes(payload, pos)
+    return data.decode("utf-8") if kind == b"s" else data, pos
+
+
+def _pack_journal_entries(entries):
+    """
+    Payload of a journal record of (timestamp, name, value) entries
+    """
+    return b"".join(
+        _JOURNAL_FLOAT.pack(ts) + _pack_bytes(key.encode("utf-8")) + _pack_value(val)
+        for ts, key, val in entries
+    )
+
+
+def _unpack_journal_entries(payload):
+    entries = list()
+    pos = 0
+    while pos < len(payload):
+        ts, = _JOURNAL_FLOAT.unpack_from(payload, pos)
+        key, pos = _unpack_bytes(payload, pos + _JOURNAL_FLOAT.size)
+        val, pos = _unpack_value(payload, pos)
+        entries.append((ts, key.decode("utf-8"), val))
+    return entries
+
+
+def _pack_journal_datasets(datasets):
+    """
+    Payload of a journal record of (timestamp, name, blob) datasets, whose
+    blobs are plain arrays encoded by _encode_dataset
+    """
+    return b"".join(
+        _JOURNAL_FLOAT.pack(ts) + _pack_bytes(key.encode("utf-8")) + _pack_bytes(blob)
+        for ts, key, blob in datasets
+    )
+
+
+def _unpack_journal_datasets(payload):
+    datasets = list()
+    pos = 0
+    while pos < len(payload):
+        ts, = _JOURNAL_FLOAT.unpack_from(payload, pos)
+        key, pos = _unpack_bytes(payload, pos + _JOURNAL_FLOAT.size)
+        blob, pos = _unpack_bytes(payload, pos)
+        datasets.append((ts, key.decode("utf-8"), blob))
+    return datasets
+
+
+def _pack_journal_rows(group, names, rows):
+    """
+    Payload of a journal record of (timestamp, value1, value2, ...) rows of
+    the given variables of group
+    """
+    header = [_pack_bytes(group.encode("utf-8")), _JOURNAL_LENGTH.pack(len(names))]
+    header.extend(_pack_bytes(key.encode("utf-8")) for key in names)
+    return b"".join(
+        header
+        + [
+            _JOURNAL_FLOAT.pack(row[0]) + b"".join(_pack_value(val) for val in row[1:])
+            for row in rows
+        ]
+    )
+
+
+def _unpack_journal_rows(payload):
+    group, pos = _unpack_bytes(payload, 0)
+    n_names, = _JOURNAL_LENGTH.unpack_from(payload, pos)
+    pos += _JOURNAL_LENGTH.size
+    names = list()
+    for _ in range(n_names):
+        key, pos = _unpack_bytes(payload, pos)
+        names.append(key.decode("utf-8"))
+    rows = list()
+    while pos < len(payload):
+        row = _JOURNAL_FLOAT.unpack_from(payload, pos)
+        pos += _JOURNAL_FLOAT.size
+        for _ in range(n_names):
+            val, pos = _unpack_value(payload, pos)
+            row += (val,)
+        rows.append(row)
+    return group.decode("utf-8"), tuple(names), rows
+
+
+def _multi_entries(timestamps, values):
+    """
+    Returns the (timestamp, name, value) entries of arrays of values of
+    several variables, which share the same array of timestamps.
+    """
+    t = np.asarray(timestamps, dtype=np.float64).ravel().tolist()
+    entries = list()
+    for key, val in values.items():
+        v = np.asarray(val, dtype=np.float64).ravel()
+        if v.size != len(t):
+            raise ValueError(
+                "{:} has {:d} values for {:d} timestamps".format(key, v.size, len(t))
+            )
+        entries.extend(zip(t, itertools.repeat(key), v.tolist()))
+    return entries
+
+
+class _RecentSamples:
+    """
+    Ring buffer of the most recent samples of a variable. All the samples
+    later than floor are in the buffer.
+    """
+
+    def __init__(self, size, floor):
+        self.t = np.empty(size)
+        self.v = np.empty(size)
+        self.pos = 0
+        self.count = 0
+        self.floor = floor
+
+    def push(self, ts, val):
+        if self.count == self.t.size:
+            self.floor = max(self.floor, self.t[self.pos])
+        else:
+            self.count += 1
+        self.t[self.pos] = ts
+        self.v[self.pos] = val
+        self.pos = (self.pos + 1) % self.t.size
+
+    def append(self, t, v):
+        size = self.t.size
+        t = np.asarray(t, dtype=np.float64)
+        v = np.asarray(v, dtype=np.float64)
+        if t.size > size:
+            self.floor = max(self.floor, t[:-size].max())
+            t, v = t[-size:], v[-size:]
+        idx = (self.pos + np.arange(t.size)) % size
+        overwritten = idx[max(size - self.count, 0) :]
+        if overwritten.size:
+            self.floor = max(self.floor, self.t[overwritten].max())
+        self.t[idx] = t
+        self.v[idx] = v
+        self.pos = (self.pos + t.size) % size
+        self.count = min(self.count + t.size, size)
+
+    def since(self, timestamp):
+        """
+        Returns the timestamps and values of the samples later than
+        timestamp, sorted by timestamp, or None if some of them are not in
+        the buffer.
+        """
+        if timestamp < self.floor:
+            return None
+        idx = np.arange(self.pos - self.count, self.pos) % self.t.size
+        t, v = self.t[idx], self.v[idx]
+        keep = (t > timestamp) & ~np.isnan(v)
+        t, v = t[keep], v[keep]
+        if (np.diff(t) < 0).any():
+            order = np.argsort(t, kind="stable")
+            t, v = t[order], v[order]
+        return t, v
+
+
+class _StreamSubscriber:
+    """
+    Client of the /api/stream endpoint, with the [timestamp, value] pairs
+    of the variables it subscribed to which were added since the last
+    message. names is None to subscribe to all variables.
+    """
+
+    def __init__(self, names=None):
+        self.names = None if names is None else set(names)
+        self.data = dict()
+        self.event = asyncio.Event()
+
+    def publish(self, entries):
+        for ts, key, val in entries:
+            if self.names is not None and key not in self.names:
+                continue
+            if val is None or val != val or isinstance(val, bytes):
+                continue
+            self.data.setdefault(key, list()).append([ts, val])
+        if self.data:
+            self.event.set()
+
+    def pop(self):
+        data = self.data
+        self.data = dict()
+        self.event.clear()
+        return data
+
+
+def _encode_columns(t, v):
+    """
+    Serializes arrays of timestamps and values in the binary format of the
+    web API
+    """
+    t = np.asarray(t, dtype="<f8")
+    v = np.asarray(v, dtype="<f8")
+    return b"".join(
+        (_COLUMNS_HEADER.pack(_COLUMNS_MAGIC, t.size), t.tobytes(), v.tobytes())
+    )
+
+
+def _decode_columns(blob):
+    magic, n = _COLUMNS_HEADER.unpack_from(blob)
+    if magic != _COLUMNS_MAGIC:
+        raise ValueError("Invalid columns data")
+    data = np.frombuffer(blob, dtype="<f8", count=2 * n, offset=_COLUMNS_HEADER.size)
+    return data[:n], data[n:]
+
+
+def _encode_columns_batch(data):
+    """
+    Serializes a dictionnary of (timestamps, values) arrays in the binary
+    format of the batch endpoint of the web API
+    """
+    return b"".join(
+        _pack_bytes(name.encode("utf-8")) + _pack_bytes(_encode_columns(t, v))
+        for name, (t, v) in data.items()
+    )
 
-__all__ = ["AsyncSession"]
+
+def _decode_columns_batch(blob):
+    data = dict()
+    pos = 0
+    while pos < len(blob):
+        name, pos = _unpack_bytes(blob, pos)
+        columns, pos = _unpack_bytes(blob, pos)
+        data[name.decode("utf-8")] = _decode_columns(columns)
+    return data
+
+
+def _split_columns(data):
+    """
+    Returns the arrays of timestamps and values of a JSON list of
+    [timestamp, value]
+    """
+    if not data:
+        return np.empty(0), np.empty(0)
+    t, v = zip(*data)
+    return np.array(t, dtype=np.float64), np.array(v)
+
+
+@web.middleware
+async def _compress_json(request, handler):
+    """
+    Compresses the JSON responses of the web server with gzip or deflate,
+    if the client accepts it
+    """
+    response = await handler(request)
+    if (
+        isinstance(response, web.Response)
+        and response.content_type == "application/json"
+        and response.body is not None
+        and len(response.body) >= 1024
+    ):
+        response.enable_compression()
+    return response
+
+
+def _decimate_minmax(t, v, max_points):
+    """
+    Min/max envelope decimation: the data is split into max_points // 2
+    buckets of equal number of points, and the minimum and maximum points
+    of each bucket are kept, in chronological order. If max_points is 1,
+    only the maximum is kept.
+    """
+    n = t.size
+    if max_points < 2:
+        keep = np.array([np.argmax(v)][:max_points], dtype=np.int64)
+        return t[keep], v[keep]
+    n_buckets = max(1, max_points // 2)
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+    index = np.arange(n)
+    vmin = np.repeat(np.minimum.reduceat(v, starts), counts)
+    vmax = np.repeat(np.maximum.reduceat(v, starts), counts)
+    imin = np.minimum.reduceat(np.where(v == vmin, index, n), starts)
+    imax = np.minimum.reduceat(np.where(v == vmax, index, n), starts)
+    keep = np.unique(np.hstack((imin, imax)))
+    return t[keep], v[keep]
+
+
+def _decimate_lttb(t, v, max_points):
+    """
+    Largest-Triangle-Three-Buckets decimation to max_points points
+    (S. Steinarsson, 2013). The first and last points are always kept.
+    """
+    n = t.size
+    if max_points < 3:
+        keep = np.array([0, n - 1][:max_points], dtype=np.int64)
+        return t[keep], v[keep]
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    keep = np.empty(max_points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    for i in range(max_points - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 2 < max_points - 1:
+            next_t = np.mean(t[edges[i + 1] : edges[i + 2]])
+            next_v = np.mean(v[edges[i + 1] : edges[i + 2]])
+        else:
+            next_t, next_v = t[-1], v[-1]
+        prev_t, prev_v = t[keep[i]], v[keep[i]]
+        area = np.abs(
+            (prev_t - next_t) * (v[start:stop] - prev_v)
+            - (prev_t - t[start:stop]) * (next_v - prev_v)
+        )
+        keep[i + 1] = start + np.argmax(area)
+    return t[keep], v[keep]
 
 
 class AsyncSession:
-    database_version = 3
+    """
+    Asynchronous monitoring session, stored by a storage backend (see
+    pymanip.storage), by default a SQLiteBackend which stores it in the
+    sqlite database <session_name>.db. The delay_save, checkpoint_pages and
+    memory_budget arguments are the options of the default backend.
+
+    If write_behind is True, entries and datasets are kept in memory and
+    written to the backend in a single transaction when flush_size entries
+    are pending, when the oldest pending entry is older than flush_interval
+    seconds, or when the session is closed.
+
+    Slices of the array datasets can be read with dataset_slice.
+
+    Once enable_aggregates has been called, count, min, max and sum of the
+    logged values are maintained in time buckets of several durations, and
+    decimated queries of long time ranges are served from them.
+
+    While the session is running, the web server and plot tasks read
+    through the reader_threads threads of the backend, if it supports
+    concurrent reads (see run_reader), so that slow queries do not block
+    the acquisition tasks. Writes all go through the event loop thread.
+
+    Delay_save sessions are saved every checkpoint_interval seconds while
+    the session is running.
+
+    Variables which are always acquired together can be logged with
+    add_group_entry, in a single row of the log_group_<group> table, with one
+    column per variable. They are read like the other logged variables.
+
+    Once enable_log_blocks has been called, the numeric values of each
+    (ungrouped) variable are packed in compressed blocks.
+
+    If journal is True, the session is in write_behind mode, and the pending
+    entries and datasets are also appended to the <session_name>.journal
+    file, so that they are replayed into the backend at the next opening if
+    the program crashes before they are flushed. The journal holds no
+    pickles: datasets which are not plain NumPy arrays are written to the
+    backend directly.
+
+    The recent_size latest samples of each numeric variable are also kept
+    in memory, so that logged_data_fromtimestamp is served without query
+    for recent timestamps.
+
+    Other threads and worker processes log through the client returned by
+    ingestion_client, whose entries, datasets and parameters are queued,
+    and written in batches by the thread of the session (see ingest). The
+    queue is also written when the session is closed, from any thread.
+    """
+
+    database_version = SQLiteBackend.database_version
+    ingest_interval = 0.1
+    recent_size = 4096
+    query_bucket = 1.0
+    spill_interval = 1.0
 
-    def __init__(self, session_name=None, verbose=True, delay_save=False):
+    def __init__(
+        self,
+        session_name=None,
+        verbose=True,
+        delay_save=False,
+        write_behind=False,
+        flush_size=1000,
+        flush_interval=5.0,
+        reader_threads=2,
+        checkpoint_interval=60.0,
+        checkpoint_pages=1024,
+        memory_budget=None,
+        backend=None,
+        journal=False,
+    ):
+        if backend is not None and (delay_save or memory_budget is not None):
+            raise ValueError("delay_save and memory_budget are options of the backend")
+        if journal and (
+            session_name is None
+            or delay_save
+            or (backend is not None and backend.delay_save)
+        ):
+            raise ValueError("journal requires an on-disk session")
+        if backend is None:
+            backend = SQLiteBackend(
+                session_name, verbose, delay_save, checkpoint_pages, memory_budget
+            )
         self.session_name = session_name
+        self.backend = backend
         self.custom_figures = None
-        self.delay_save = delay_save
-        if session_name is not None:
-            session_name = str(session_name)  # in case it is a Path object
-            if session_name.endswith(".db"):
-                session_name = session_name[:-3]
-        elif delay_save:
-            raise ValueError("Cannot delay_save if session_name is not specified")
-        if session_name is None or delay_save:
-            # For no name session, or in case of delay_save=True, then
-            # the connection is in-memory
-            self.conn = sqlite3.connect(":memory:")
-        else:
-            # Otherwise, the connection is on the disk for immediate writing
-            self.conn = sqlite3.connect(session_name + ".db")
-        if delay_save and os.path.exists(session_name + ".db"):
-            # Load existing database into in-memory database
-            disk_db = sqlite3.connect(session_name + ".db")
-            try:
-                with self.conn as c:
-                    for line in disk_db.iterdump():
-                        c.execute(line)
-            finally:
-                disk_db.close()
-        with self.conn as c:
-            tables = list(c.execute("SELECT name FROM sqlite_master;"))
-            if not tables:
-                c.execute(
-                    """
-                    CREATE TABLE log_names (
-                    name TEXT);
-                    """
-                )
-                c.execute(
-                    """
-                    CREATE TABLE log (
-                    timestamp INT,
-                    name TEXT,
-                    value REAL);
-                    """
-                )
-                c.execute(
-                    """
-                    CREATE TABLE dataset_names (
-                    name TEXT);
-                    """
-                )
-                c.execute(
-                    """
-                    CREATE TABLE dataset (
-                    timestamp INT,
-                    name TEXT,
-                    data BLOB);
-                    """
-                )
-                c.execute(
-                    """
-                    CREATE TABLE parameters (
-                        name TEXT,
-                        value REAL);
-                    """
-                )
-                c.execute(
-                    """
-                    INSERT INTO parameters
-                    (name, value)
-                    VALUES (?,?);
-                    """,
-                    ("_database_version", AsyncSession.database_version),
-                )
-                c.execute(
-                    """
-                    INSERT INTO parameters
-                    (name, value)
-                    VALUES (?,?);
-                    """,
-                    ("_session_creation_timestamp", datetime.now().timestamp()),
-                )
-            elif verbose:
-                self.print_welcome()
+        self.write_behind = write_behind
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._pending_entries = list()
+        self._pending_datasets = list()
+        self._pending_groups = list()
+        self._pending_since = None
+        self.reader_threads = reader_threads
+        self.checkpoint_interval = checkpoint_interval
+        self._journal = None
+        self._owner_thread = threading.get_ident()
+        self._ingest_queue = queue.SimpleQueue()
+        self._process_queue = None
+        self._recent = dict()
+        self._subscribers = set()
+        self._query_cache = dict()
         self.figure_list = []
         self.template_dir = os.path.join(os.path.dirname(__file__), "web")
         self.static_dir = os.path.join(os.path.dirname(__file__), "web_static")
         self.jinja2_loader = jinja2.FileSystemLoader(self.template_dir)
+        if backend.created:
+            self.save_parameter(_session_creation_timestamp=datetime.now().timestamp())
+        self._log_groups = self.backend.log_groups()
+        self._last_values = self.backend.last_values()
+        if journal:
+            self.write_behind = True
+            session_name = str(session_name)
+            if session_name.endswith(".db"):
+                session_name = session_name[:-3]
+            self._open_journal(session_name + ".journal")
+        if not backend.created and verbose:
+            self.print_welcome()
+
+    @property
+    def conn(self):
+        """
+        Connection of the default SQLiteBackend
+        """
+        return self.backend.conn
+
+    @property
+    def delay_save(self):
+        return self.backend.delay_save
+
+    @property
+    def memory_budget(self):
+        return self.backend.memory_budget
+
+    def _open_journal(self, path):
+        """
+        Replays the records of an existing journal which are not in the
+        database yet, then starts a new journal.
+        """
+        if os.path.exists(path):
+            self._journal = open(path, "r+b")
+            self._replay_journal()
+            self._journal.seek(0, os.SEEK_END)
+            self.flush()
+        else:
+            self._journal = open(path, "wb")
+        self._reset_journal()
+
+    def _replay_journal(self):
+        """
+        Reads the valid records of the journal into the pending entries and
+        datasets. Records up to the offset saved by the last flush of the
+        same journal epoch are skipped, and reading stops at the first
+        incomplete or corrupted record, or at a dataset which is not an
+        array, so that replaying a journal does not unpickle anything.
+        """
+        self._journal.seek(0)
+        data = self._journal.read()
+        pos = len(_JOURNAL_MAGIC) + 8
+        if len(data) < pos or not data.startswith(_JOURNAL_MAGIC):
+            return
+        self._journal_epoch, = struct.unpack_from("<q", data, len(_JOURNAL_MAGIC))
+        applied = self.parameter("_journal_applied")
+        if applied is not None and applied[0] == self._journal_epoch:
+            pos = max(pos, applied[1])
+        while pos + _JOURNAL_RECORD.size <= len(data):
+            kind, length, crc = _JOURNAL_RECORD.unpack_from(data, pos)
+            pos += _JOURNAL_RECORD.size
+            payload = data[pos : pos + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            pos += length
+            if kind == b"E":
+                entries = _unpack_journal_entries(payload)
+                self._buffer_recent(entries)
+                self._update_last_values(entries)
+                self._pending_entries.extend(entries)
+            elif kind == b"D":
+                datasets = _unpack_journal_datasets(payload)
+                if any(_parse_array_header(blob)[0] is None for _, _, blob in datasets):
+                    # only arrays are journaled, a pickle is not unpickled
+                    break
+                self._pending_datasets.extend(datasets)
+            elif kind == b"G":
+                group, names, rows = _unpack_journal_rows(payload)
+                self._buffer_recent_rows(names, rows)
+                self._update_last_rows(names, rows)
+                self._pending_groups.append((group, names, rows))
+
+    def _reset_journal(self):
+        self._journal_epoch = time.time_ns()
+        self._journal.seek(0)
+        self._journal.truncate()
+        self._journal.write(_JOURNAL_MAGIC + struct.pack("<q", self._journal_epoch))
+        self._journal.flush()
+
+    def _journal_append(self, kind, records):
+        """
+        Appends a record of pending entries (kind b"E"), datasets (b"D") or
+        grouped rows (b"G") to the journal. The file is flushed to the
+        operating system, so that the record survives a crash of the
+        program.
+        """
+        if kind == b"E":
+            payload = _pack_journal_entries(records)
+        elif kind == b"D":
+            payload = _pack_journal_datasets(records)
+        else:
+            payload = _pack_journal_rows(*records)
+        self._journal.write(
+            _JOURNAL_RECORD.pack(kind, len(payload), zlib.crc32(payload)) + payload
+        )
+        self._journal.flush()
 
     def save_database(self):
         """
-        If delay_save = True, the database is kept in-memory, and later
-        saved to disk when this function is called.
-        A new database file will be created with the content of the current
-        in-memory database
+        Saves the data that the backend keeps in memory, e.g. the in-memory
+        database of delay_save sessions.
         """
-        if self.delay_save:
-            try:
-                os.remove(self.session_name + ".db")
-            except FileNotFoundError:
-                pass
-            disk_db = sqlite3.connect(self.session_name + ".db")
-            try:
-                with disk_db as c:
-                    for line in self.conn.iterdump():
-                        c.execute(line)
-            finally:
-                disk_db.close()
+        self.flush()
+        self.backend.save_database()
+
+    async def checkpoint_task(self):
+        """
+        Asynchronous task which saves the in-memory database of delay_save
+        sessions every checkpoint_interval seconds. The steps of the
+        checkpoint which write to the file run in another thread, so that
+        the event loop keeps running (see StorageBackend.checkpoint).
+        """
+        loop = asyncio.get_event_loop()
+        while self.running:
+            await self.sleep(self.checkpoint_interval, verbose=False)
+            if self.running:
+                self.flush()
+                for step in self.backend.checkpoint():
+                    if step is None:
+                        await asyncio.sleep(0)
+                    else:
+                        await loop.run_in_executor(None, step)
+
+    async def spill_task(self):
+        """
+        Asynchronous task which spills the in-memory database of a
+        memory_budget session when it exceeds the budget, every
+        spill_interval seconds. The event loop runs between the batches.
+        While this task runs, the writes do not spill.
+        """
+        self.backend.background_spill = True
+        try:
+            while self.running:
+                for _ in self.backend.spill_batches():
+                    await asyncio.sleep(0)
+                await asyncio.sleep(self.spill_interval)
+        finally:
+            self.backend.background_spill = False
+
+    def memory_usage(self):
+        """
+        Returns the size in bytes of the data kept in memory by the backend,
+        e.g. the in-memory database of delay_save sessions.
+        """
+        return self.backend.memory_usage()
 
     def __enter__(self):
         return self
 
     def __exit__(self, type_, value, cb):
-        self.save_database()
-        self.conn.close()
+        self.stop_readers()
+        self.flush()
+        self.backend.close()
+        if self._journal is not None:
+            self._journal.close()
+            os.remove(self._journal.name)
+            self._journal = None
 
     def get_version(self):
-        version = self.parameter("_database_version")
-        if version is None:
-            version = 1
-        return version
+        return self.backend.get_version()
 
     @property
     def t0(self):
-        if hasattr(self, "_session_creation_timestamp"):
-            return self._session_creation_timestamp
         t0 = self.parameter("_session_creation_timestamp")
         if t0 is not None:
-            self._session_creation_timestamp = t0
             return t0
         logged_data = self.logged_first_values()
         if logged_data:
             t0 = min([v[0] for k, v in logged_data.items()])
             self.save_parameter(_session_creation_timestamp=t0)
-            self._session_creation_timestamp = t0
             return t0
         return 0
 
@@ -189,8 +708,10 @@ class AsyncSession:
         last_values = self.logged_last_values()
         if last_values:
             ts.append(max([t_v[0] for name, t_v in last_values.items()]))
-        for ds_name in self.dataset_names():
-            ts.append(max(self.dataset_times(ds_name)))
+        self.flush()
+        ds_last = self.backend.last_dataset_timestamp()
+        if ds_last is not None:
+            ts.append(ds_last)
         if ts:
             return max(ts)
         return None
@@ -205,38 +726,415 @@ class AsyncSession:
 
     def add_entry(self, **kwargs):
         ts = datetime.now().timestamp()
-        with self.conn as c:
-            cursor = c.cursor()
-            cursor.execute("SELECT name FROM log_names;")
-            names = set([d[0] for d in cursor.fetchall()])
-            for key, val in kwargs.items():
-                if key not in names:
-                    c.execute("INSERT INTO log_names VALUES (?);", (key,))
-                    names.add(key)
-                c.execute("INSERT INTO log VALUES (?,?,?);", (ts, key, val))
+        self._add_entries([(ts, key, _real(val)) for key, val in kwargs.items()])
+
+    def add_entries(self, name, timestamps, values):
+        """
+        Logs an array of values for variable name, with the corresponding
+        array of timestamps (in seconds since epoch). All the values are
+        inserted with a single executemany call.
+        """
+        self.add_entries_multi(timestamps, **{name: values})
+
+    def add_entries_multi(self, timestamps, **kwargs):
+        """
+        Logs arrays of values for several variables which share the same
+        array of timestamps, e.g. the channels of a DAQ read.
+        """
+        self._add_entries(_multi_entries(timestamps, kwargs))
+
+    def ingestion_client(self, processes=False):
+        """
+        Returns a client which logs into this session from other threads or,
+        if processes is True, from worker processes to which it is passed.
+        """
+        if not processes:
+            return IngestionClient(self._ingest_queue)
+        if self._process_queue is None:
+            self._process_queue = multiprocessing.Queue()
+        return IngestionClient(self._process_queue)
+
+    def ingest(self):
+        """
+        Writes the records queued by other threads and processes. Consecutive
+        log entries are written in a single batch. Returns the number of
+        records.
+        """
+        records = list()
+        for q in (self._ingest_queue, self._process_queue):
+            while q is not None:
+                try:
+                    records.append(q.get_nowait())
+                except queue.Empty:
+                    break
+        entries = list()
+        for kind, payload in records:
+            if kind == "E":
+                entries.extend(payload)
+                continue
+            if entries:
+                self._add_entries(entries)
+                entries = list()
+            if kind == "D":
+                self._add_datasets(
+                    [(ts, key, _decode_dataset(blob)) for ts, key, blob in payload]
+                )
+            elif kind == "G":
+                self._add_group_rows(*payload)
+            elif kind == "P":
+                self.save_parameter(**payload)
+        if entries:
+            self._add_entries(entries)
+        return len(records)
+
+    async def ingest_task(self):
+        """
+        Asynchronous task which writes the queued records every
+        ingest_interval seconds.
+        """
+        while self.running:
+            self.ingest()
+            await asyncio.sleep(self.ingest_interval)
+        self.ingest()
+
+    def _add_entries(self, entries):
+        if self._log_groups:
+            for ts, key, val in entries:
+                if key in self._log_groups:
+                    raise ValueError("{:} is logged in a group".format(key))
+        if self.backend.numeric_only:
+            self._check_numeric((key, val) for ts, key, val in entries)
+        self._buffer_recent(entries)
+        self._update_last_values(entries)
+        self._query_cache.clear()
+        for subscriber in self._subscribers:
+            subscriber.publish(entries)
+        if self.write_behind:
+            if self._journal is not None:
+                self._journal_append(b"E", entries)
+            self._pending_entries.extend(entries)
+            self._flush_if_needed()
+        else:
+            self.backend.add_entries(entries)
+
+    def _buffer_recent(self, entries):
+        """
+        Appends a list of (timestamp, name, value) entries to the ring
+        buffers of recent samples. Variables with non-numeric values are
+        not buffered.
+        """
+        samples = dict()
+        for ts, key, val in entries:
+            samples.setdefault(key, list()).append((ts, val))
+        for key, data in samples.items():
+            buf = self._recent.get(key)
+            if buf is None:
+                if key in self._recent:
+                    continue
+                last = self._last_values.get(key)
+                buf = _RecentSamples(
+                    self.recent_size, -np.inf if last is None else last[0]
+                )
+            if not all(val is None or isinstance(val, float) for ts, val in data):
+                self._recent[key] = None
+                continue
+            self._recent[key] = buf
+            if len(data) == 1:
+                ts, val = data[0]
+                buf.push(ts, np.nan if val is None else val)
+            else:
+                buf.append(
+                    [ts for ts, val in data],
+                    [np.nan if val is None else val for ts, val in data],
+                )
+
+    def _buffer_recent_rows(self, names, rows):
+        entries = [
+            (row[0], key, val) for row in rows for key, val in zip(names, row[1:])
+        ]
+        self._buffer_recent(entries)
+        self._query_cache.clear()
+        for subscriber in self._subscribers:
+            subscriber.publish(entries)
+
+    def _recent_data(self, name, timestamp):
+        """
+        Returns the timestamps and values of variable name later than
+        timestamp from the ring buffer, or None if they are not all in it.
+        The buffers are only used by the thread of the session.
+        """
+        if threading.get_ident() != self._owner_thread:
+            return None
+        self.ingest()
+        buf = self._recent.get(name)
+        if buf is None:
+            return None
+        return buf.since(timestamp)
+
+    def add_group_entry(self, group, **kwargs):
+        """
+        Logs variables which are acquired together, e.g. the channels of a
+        multi-channel logger, in a single row of the table of group, which
+        has one column per variable. A variable cannot be logged both in a
+        group and with add_entry. NaN values of grouped variables are not
+        read back.
+        """
+        ts = datetime.now().timestamp()
+        names = tuple(kwargs)
+        self._add_group_rows(
+            group, names, [(ts,) + tuple(_real(kwargs[key]) for key in names)]
+        )
+
+    def add_group_entries(self, group, timestamps, **kwargs):
+        """
+        Logs arrays of values of grouped variables, which share the same
+        array of timestamps.
+        """
+        columns = [np.asarray(timestamps, dtype=np.float64).ravel()]
+        for key, val in kwargs.items():
+            v = np.asarray(val, dtype=np.float64).ravel()
+            if v.size != columns[0].size:
+                raise ValueError(
+                    "{:} has {:d} values for {:d} timestamps".format(
+                        key, v.size, columns[0].size
+                    )
+                )
+            columns.append(v)
+        rows = list(zip(*[col.tolist() for col in columns]))
+        self._add_group_rows(group, tuple(kwargs), rows)
+
+    def _add_group_rows(self, group, names, rows):
+        if self.backend.numeric_only:
+            self._check_numeric(pair for row in rows for pair in zip(names, row[1:]))
+        self._declare_group(group, names)
+        self._buffer_recent_rows(names, rows)
+        self._update_last_rows(names, rows)
+        if self.write_behind:
+            if self._journal is not None:
+                self._journal_append(b"G", (group, names, rows))
+            self._pending_groups.append((group, names, rows))
+            self._flush_if_needed()
+        else:
+            self.backend.add_group_rows(group, names, rows)
+
+    def _check_numeric(self, values):
+        """
+        Raises ValueError for the non-numeric values of the (name, value)
+        pairs, before the session state is changed
+        """
+        for key, val in values:
+            if val is not None and not isinstance(val, float):
+                raise ValueError(
+                    "{:} cannot log the {:} value of {:}".format(
+                        type(self.backend).__name__, type(val).__name__, key
+                    )
+                )
+
+    def _declare_group(self, group, names):
+        """
+        Checks that the variables are not logged outside of group, and
+        declares the new ones to the backend
+        """
+        new = list()
+        for key in names:
+            if self._log_groups.get(key, group) != group:
+                raise ValueError(
+                    "{:} is logged in group {:}".format(key, self._log_groups[key])
+                )
+            if key not in self._log_groups:
+                new.append(key)
+        if not new:
+            return
+        self.flush()
+        logged = self.backend.logged_variables()
+        for key in new:
+            if key in logged:
+                raise ValueError("{:} is logged outside of a group".format(key))
+        if not group.isidentifier():
+            raise ValueError("Group names must be valid identifiers")
+        self.backend.declare_group(group, new)
+        self._log_groups.update((key, group) for key in new)
 
     def add_dataset(self, **kwargs):
         ts = datetime.now().timestamp()
-        with self.conn as c:
-            cursor = c.cursor()
-            cursor.execute("SELECT name FROM dataset_names;")
-            names = set([d[0] for d in cursor.fetchall()])
-            for key, val in kwargs.items():
-                if key not in names:
-                    c.execute("INSERT INTO dataset_names VALUES (?);", (key,))
-                    names.add(key)
-                c.execute(
-                    "INSERT INTO dataset VALUES (?,?,?);",
-                    (ts, key, pickle.dumps(val, protocol=4)),
+        self._add_datasets([(ts, key, val) for key, val in kwargs.items()])
+
+    def _add_datasets(self, values):
+        """
+        Saves a list of (timestamp, name, value) datasets. In write_behind
+        mode, they are kept encoded until they are flushed, so that arrays
+        which are modified afterwards are saved as they were, except the
+        arrays which the backend stores in chunks, and in journal mode the
+        values which are not plain arrays, which are written immediately.
+        """
+        if not self.write_behind:
+            self.backend.add_datasets(values)
+            return
+        chunk_size = self.backend.dataset_chunk_size
+        datasets = list()
+        for ts, key, val in values:
+            if _is_plain_array(val):
+                direct = (
+                    chunk_size is not None and val.ndim > 0 and val.nbytes > chunk_size
                 )
+            else:
+                # the other values are pickled, which the journal does not hold
+                direct = self._journal is not None
+            if direct:
+                self.backend.add_datasets([(ts, key, val)])
+            else:
+                datasets.append((ts, key, _encode_dataset(val)))
+        if datasets:
+            if self._journal is not None:
+                self._journal_append(b"D", datasets)
+            self._pending_datasets.extend(datasets)
+            self._flush_if_needed()
+
+    def set_dataset_compression(self, name, compression):
+        """
+        Selects the compression ("zlib", "lzma" or None) of the NumPy arrays
+        subsequently saved with add_dataset under the given name.
+        """
+        if compression not in _ARRAY_COMPRESSORS:
+            raise ValueError("Unknown compression {:}".format(compression))
+        self.backend.dataset_compression[name] = compression
+
+    def enable_log_blocks(self, block_size=4096):
+        """
+        Packs the numeric values of each variable, including the existing
+        ones, in compressed blocks of block_size samples, which are decoded
+        without loss when they are read. Grouped variables are not packed.
+        This setting is saved by the backend.
+        """
+        self.flush()
+        self.backend.enable_log_blocks(block_size)
+
+    def enable_aggregates(self, levels=(1.0, 60.0, 3600.0)):
+        """
+        Maintains count, min, max and sum of the logged values in buckets of
+        the given durations (in seconds). The buckets of new levels are
+        built from the existing data, then they are updated as entries are
+        added. The levels are saved by the backend.
+        """
+        levels = [float(level) for level in levels]
+        if any(level <= 0 for level in levels):
+            raise ValueError("Aggregate levels must be positive")
+        self.flush()
+        self.backend.enable_aggregates(levels)
+
+    def logged_data_aggregate(self, name, level, t_start=None, t_end=None):
+        """
+        Returns the start time, number of points, minimum, maximum and mean
+        of the buckets of duration level of variable name, between t_start
+        and t_end. The first and last buckets may include points outside of
+        the range.
+        """
+        if level not in self.backend.aggregate_levels():
+            raise ValueError("No aggregate at level {:}".format(level))
+        self.flush()
+        return self.backend.read_aggregates(name, level, t_start, t_end)
+
+    def _flush_if_needed(self):
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        n_pending = (
+            len(self._pending_entries)
+            + len(self._pending_datasets)
+            + sum(len(rows) for group, names, rows in self._pending_groups)
+        )
+        if (
+            n_pending >= self.flush_size
+            or time.monotonic() - self._pending_since >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Writes pending entries and datasets to the backend, in a single
+        transaction. This is a no-op unless write_behind is True.
+        In journal mode, the journal offset is saved in the same
+        transaction, and the journal is then emptied.
+        """
+        if self.backend.in_reader_thread():
+            # the reader threads do not write, run_reader flushes beforehand
+            return
+        self.ingest()
+        if (
+            not self._pending_entries
+            and not self._pending_datasets
+            and not self._pending_groups
+        ):
+            return
+        entries, self._pending_entries = self._pending_entries, list()
+        datasets, self._pending_datasets = self._pending_datasets, list()
+        groups, self._pending_groups = self._pending_groups, list()
+        self._pending_since = None
+        parameters = None
+        if self._journal is not None:
+            parameters = {
+                "_journal_applied": [self._journal_epoch, self._journal.tell()]
+            }
+        self.backend.write(
+            entries,
+            groups,
+            [(ts, key, _decode_dataset(blob)) for ts, key, blob in datasets],
+            parameters,
+        )
+        if self._journal is not None:
+            self._reset_journal()
+
+    def start_readers(self):
+        """
+        Starts the reader threads of the backend used by run_reader, e.g.
+        switches on-disk sqlite databases to WAL mode, with one read-only
+        connection per thread. This is a no-op for in-memory databases or
+        if reader_threads is 0.
+        """
+        self.flush()
+        self.backend.start_readers(self.reader_threads)
+
+    def stop_readers(self):
+        self.backend.stop_readers()
+
+    async def run_reader(self, method, *args, **kwargs):
+        """
+        Awaitable call of a read method of the session in the reader
+        thread pool, e.g.
+
+            t, v = await sesn.run_reader(sesn.logged_data_fromtimestamp, "a", ts)
+
+        If the reader threads are not started, the method is called directly.
+        """
+        if self.backend.reader_pool is None:
+            return method(*args, **kwargs)
+        if method == self.logged_data_fromtimestamp:
+            # recent data is sliced from the ring buffers in this thread
+            recent = self._recent_data(*args, **kwargs)
+            if recent is not None:
+                return recent
+        self.flush()
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.backend.reader_pool, functools.partial(method, *args, **kwargs)
+        )
+
+    async def write_behind_flush(self):
+        """
+        Asynchronous task which flushes pending entries when they get
+        older than flush_interval.
+        """
+        while self.running:
+            if (
+                self._pending_since is not None
+                and time.monotonic() - self._pending_since >= self.flush_interval
+            ):
+                self.flush()
+            await asyncio.sleep(min(self.flush_interval, 0.5))
+        self.flush()
 
     def logged_variables(self):
-        with self.conn as conn:
-            c = conn.cursor()
-            c.execute("SELECT name FROM log_names;")
-            data = c.fetchall()
-        names = set([d[0] for d in data])
-        return names
+        self.flush()
+        return set(self.backend.logged_variables())
 
     def logged_data(self):
         names = self.logged_variables()
@@ -246,198 +1144,243 @@ class AsyncSession:
         return result
 
     def logged_first_values(self):
-        with self.conn as conn:
-            c = conn.cursor()
-            c.execute("SELECT name FROM log_names;")
-            names = set([d[0] for d in c.fetchall()])
-            result = dict()
-            for name in names:
-                c.execute(
-                    """SELECT timestamp, value FROM log
-                             WHERE name='{:}'
-                             ORDER BY timestamp ASC
-                             LIMIT 1;
-                          """.format(
-                        name
-                    )
-                )
-                result[name] = c.fetchone()
-        return result
+        self.flush()
+        return self.backend.first_values()
 
     def logged_last_values(self):
-        with self.conn as conn:
-            c = conn.cursor()
-            c.execute("SELECT name FROM log_names;")
-            names = set([d[0] for d in c.fetchall()])
-            result = dict()
-            for name in names:
-                c.execute(
-                    """SELECT timestamp, value FROM log
-                             WHERE name='{:}'
-                             ORDER BY timestamp DESC
-                             LIMIT 1;
-                          """.format(
-                        name
-                    )
-                )
-                result[name] = c.fetchone()
-        return result
+        """
+        Returns the last (timestamp, value) of each logged variable.
+        They are kept up to date in memory by add_entry, so that this does
+        not access the database.
+        """
+        return dict(self._last_values)
+
+    def _update_last_values(self, entries):
+        for ts, key, val in entries:
+            last = self._last_values.get(key)
+            if last is None or ts >= last[0]:
+                self._last_values[key] = (ts, val)
+
+    def _update_last_rows(self, names, rows):
+        last = max(rows, key=lambda row: row[0])
+        self._update_last_values(
+            [
+                (last[0], key, val)
+                for key, val in zip(names, last[1:])
+                if val is not None
+            ]
+        )
 
     def logged_data_fromtimestamp(self, name, timestamp):
-        with self.conn as conn:
-            c = conn.cursor()
-            c.execute(
-                """SELECT timestamp, value FROM log
-                         WHERE name='{:}' AND timestamp > {:}
-                         ORDER BY timestamp ASC;
-                      """.format(
-                    name, timestamp
-                )
+        recent = self._recent_data(name, timestamp)
+        if recent is not None:
+            return recent
+        self.flush()
+        return self.backend.read_log(
+            name, t_start=timestamp, include_start=False, skip_null=True
+        )
+
+    def logged_data_range(
+        self, name, t_start=None, t_end=None, max_points=None, method="minmax"
+    ):
+        """
+        Returns the timestamps and values of variable name between t_start
+        and t_end (included). If max_points is specified, the data is
+        decimated to at most max_points points, either keeping the minimum
+        and maximum of each bucket (method="minmax"), or with the
+        Largest-Triangle-Three-Buckets algorithm (method="lttb").
+        If aggregates are enabled, long ranges are decimated from the
+        aggregate buckets instead of the raw data. Otherwise, the minimum
+        and maximum of time buckets are selected by the backend if it can,
+        so that the whole range is not loaded in memory. Non-numeric data
+        is not decimated.
+        """
+        if method not in ("minmax", "lttb"):
+            raise ValueError("Unknown decimation method {:}".format(method))
+        self.flush()
+        if max_points is not None and self.backend.aggregate_levels():
+            decimated = self._aggregated_data_range(
+                name, t_start, t_end, max_points, method
+            )
+            if decimated is not None:
+                return decimated
+        elif max_points is not None:
+            decimated = self._bucketed_data_range(
+                name, t_start, t_end, max_points, method
             )
-            data = c.fetchall()
-        t = np.array([d[0] for d in data if d[1] is not None])
-        v = np.array([d[1] for d in data if d[1] is not None])
+            if decimated is not None:
+                return decimated
+        t, v = self.backend.read_log(name, t_start, t_end, skip_null=True)
+        if max_points is not None and t.size > max_points and v.dtype.kind == "f":
+            if method == "minmax":
+                t, v = _decimate_minmax(t, v, max_points)
+            else:
+                t, v = _decimate_lttb(t, v, max_points)
+        return t, v
+
+    def logged_data_batch(
+        self, names=None, t_start=None, t_end=None, max_points=None, method="minmax"
+    ):
+        """
+        Returns a dictionnary of the (timestamps, values) of several
+        variables, all the logged variables by default, as returned by
+        logged_data_range.
+        """
+        if names is None:
+            names = sorted(self.logged_variables())
+        return {
+            name: self.logged_data_range(name, t_start, t_end, max_points, method)
+            for name in names
+        }
+
+    def _bucketed_data_range(self, name, t_start, t_end, max_points, method):
+        """
+        Decimates a range from the points of minimum and maximum value of
+        time buckets selected by the backend: max_points // 2 buckets
+        (method="minmax"), or 4 * max_points buckets, which are then
+        decimated with the Largest-Triangle-Three-Buckets algorithm
+        (method="lttb").
+        Returns None if the range has at most max_points points, or if the
+        backend does not select the buckets.
+        """
+        n_buckets = max(1, max_points // 2 if method == "minmax" else 4 * max_points)
+        points = self.backend.read_log_extrema(
+            name, t_start, t_end, n_buckets, max_points
+        )
+        if points is None:
+            return None
+        t, v = points
+        if method == "minmax":
+            if t.size > max_points:
+                t, v = _decimate_minmax(t, v, max_points)
+        elif t.size > max_points:
+            t, v = _decimate_lttb(t, v, max_points)
         return t, v
 
+    def _aggregated_data_range(self, name, t_start, t_end, max_points, method):
+        """
+        Decimates a range from the finest aggregate level which yields at
+        most max_points points: min and max (method="minmax") or mean
+        (method="lttb") of each bucket, at the bucket center.
+        Returns None if the range has less than max_points raw points.
+        """
+        if t_start is None or t_end is None:
+            time_range = self.backend.log_time_range(name)
+            if time_range is None:
+                return None
+            if t_start is None:
+                t_start = time_range[0]
+            if t_end is None:
+                t_end = time_range[1]
+        points_per_bucket = 2 if method == "minmax" else 1
+        for level in self.backend.aggregate_levels():
+            if (t_end - t_start) / level * points_per_bucket <= max_points:
+                break
+        data = self.backend.read_aggregates(name, level, t_start, t_end)
+        if data[1].sum() <= max_points:
+            return None
+        t, n, vmin, vmax, vmean = data
+        if method == "minmax":
+            t = np.repeat(t + level / 2, 2)
+            v = np.column_stack((vmin, vmax)).ravel()
+            if t.size > max_points:
+                t, v = _decimate_minmax(t, v, max_points)
+        else:
+            t, v = t + level / 2, vmean
+            if t.size > max_points:
+                t, v = _decimate_lttb(t, v, max_points)
+        return t, v
+
+    def _tail_start(self, name, n):
+        """
+        Returns the timestamp of the n-th last value of variable name,
+        or None if less than n values are logged.
+        """
+        self.flush()
+        return self.backend.tail_start(name, n)
+
+    def iter_logged_data(self, name, chunk_size=100000, timestamp=None):
+        """
+        Generator of (timestamps, values) arrays of at most chunk_size points,
+        for processing very long variables out of core.
+        If timestamp is specified, only data after timestamp is returned.
+        """
+        self.flush()
+        yield from self.backend.iter_log(name, chunk_size, timestamp)
+
     def dataset_names(self):
-        with self.conn as conn:
-            c = conn.cursor()
-            try:
-                c.execute("SELECT name from dataset_names;")
-                data = c.fetchall()
-            except sqlite3.OperationalError:
-                return set()
-        return set([d[0] for d in data])
+        self.flush()
+        return set(self.backend.dataset_names())
 
     def datasets(self, name):
-        with self.conn as conn:
-            c = conn.cursor()
-            try:
-                c.execute("SELECT name from dataset_names;")
-                data = c.fetchall()
-            except sqlite3.OperationalError:
-                data = set()
-            names = set([d[0] for d in data])
-            if name not in names:
-                print("Possible dataset names are", names)
-                raise ValueError(f'Bad dataset name "{name:}"')
-            it = c.execute(
-                """SELECT timestamp, data FROM dataset
-                              WHERE name='{:}'
-                              ORDER BY timestamp ASC;
-                           """.format(
-                    name
-                )
-            )
-            for row in it:
-                yield row[0], pickle.loads(row[1])
+        self.flush()
+        names = self.backend.dataset_names()
+        if name not in names:
+            print("Possible dataset names are", names)
+            raise ValueError(f'Bad dataset name "{name:}"')
+        yield from self.backend.iter_datasets(name)
 
     def dataset_last_data(self, name):
         return next(self.datasets(name))
 
     def dataset_times(self, name):
-        with self.conn as conn:
-            c = conn.cursor()
-            it = c.execute(
-                """SELECT timestamp FROM dataset
-                              WHERE name='{:}'
-                              ORDER BY timestamp ASC;
-                           """.format(
-                    name
-                )
-            )
-            t = np.array([v[0] for v in it])
-        return t
+        self.flush()
+        return np.asarray(self.backend.dataset_times(name))
 
     def dataset(self, name, ts=None):
         if ts is None:
             ts, data = self.dataset_last_data(name)
             return data
-        with self.conn as conn:
-            c = conn.cursor()
-            c.execute(
-                """SELECT data FROM dataset
-                         WHERE name='{:}' AND timestamp='{:}';
-                      """.format(
-                    name, ts
-                )
-            )
-            data = pickle.loads(c.fetchone()[0])
-        return data
+        self.flush()
+        return self.backend.read_dataset(name, ts)
+
+    def dataset_slice(self, name, ts, start=None, stop=None):
+        """
+        Returns dataset(name, ts)[start:stop] for an array dataset.
+        The sqlite backend only reads the requested rows of uncompressed
+        arrays.
+        """
+        self.flush()
+        return self.backend.dataset_slice(name, ts, start, stop)
+
+    def compact(self, max_age=None, bucket=60.0, keep_datasets=None, vacuum=True):
+        """
+        Reduces the size of the database.
+        Numeric log values older than max_age seconds are replaced by their
+        mean over buckets of the given duration (in seconds), placed at the
+        mean timestamp of the bucket. Calling compact again does not average
+        means with raw values.
+        If keep_datasets is specified, only the keep_datasets latest
+        datasets of each name are kept.
+        Finally, the database file is rebuilt with VACUUM.
+        """
+        self.flush()
+        self.backend.compact(max_age, bucket, keep_datasets, vacuum)
+        self._last_values = self.backend.last_values()
+        self._recent = dict()
+        self._query_cache.clear()
 
     def save_parameter(self, **kwargs):
-        with self.conn as conn:
-            c = conn.cursor()
-            for key, val in kwargs.items():
-                c.execute(
-                    """SELECT rowid FROM parameters
-                             WHERE name='{:}';
-                          """.format(
-                        key
-                    )
-                )
-                rowid = c.fetchone()
-                if rowid is not None:
-                    rowid = rowid[0]
-                    c.execute(
-                        """
-                        REPLACE INTO parameters
-                        (rowid, name, value)
-                        VALUES (?,?,?);
-                        """,
-                        (rowid, key, val),
-                    )
-                else:
-                    c.execute(
-                        """
-                        INSERT INTO parameters
-                        (name, value)
-                        VALUES (?,?);
-                        """,
-                        (key, val),
-                    )
+        """
+        Saves parameters of the session. Numbers are saved as REAL, other
+        values (strings, lists, dicts, ...) must be serializable to JSON.
+        The parameters are also kept in memory by the backend, so that
+        reading them does not access the storage.
+        """
+        self.backend.save_parameters(kwargs)
 
     def parameter(self, name):
-        with self.conn as conn:
-            c = conn.cursor()
-            c.execute(
-                """
-                      SELECT value FROM parameters
-                      WHERE name='{:}';
-                      """.format(
-                    name
-                )
-            )
-            data = c.fetchone()
-            if data:
-                return data[0]
-        return None
+        return self.backend.parameter(name)
 
     def has_parameter(self, name):
         return self.parameter(name) is not None
 
     def parameters(self):
-        with self.conn as conn:
-            c = conn.cursor()
-            c.execute("SELECT * FROM parameters;")
-            data = c.fetchall()
-        return {d[0]: d[1] for d in data}
+        return self.backend.load_parameters()
 
     def __getitem__(self, key):
-        with self.conn as conn:
-            c = conn.cursor()
-            c.execute(
-                """
-                      SELECT timestamp, value FROM log
-                      WHERE name='{:}';
-                      """.format(
-                    key
-                )
-            )
-            data = c.fetchall()
-        t = np.array([d[0] for d in data])
-        v = np.array([d[1] for d in data])
-        return t, v
+        self.flush()
+        return self.backend.read_log(key)
 
     async def send_email(
         self,
@@ -567,25 +1510,32 @@ class AsyncSession:
             param_key_figsize = "_figsize_" + "_".join(varnames)
             xymode = False
         last_update = {k: 0 for k in varnames}
+        if not xymode:
+            # Only the last maxvalues points are displayed
+            for k in varnames:
+                ts_start = await self.run_reader(self._tail_start, k, maxvalues)
+                if ts_start is not None:
+                    last_update[k] = np.nextafter(ts_start, -np.inf)
         saved_geom = self.parameter(param_key_window)
-        if saved_geom:
-            saved_geom = eval(saved_geom)
         saved_figsize = self.parameter(param_key_figsize)
-        if saved_figsize:
-            saved_figsize = eval(saved_figsize)
+        if not isinstance(saved_figsize, list):
+            # previous versions saved them as str
+            saved_geom, saved_figsize = None, None
         plt.ion()
         fig = plt.figure(figsize=saved_figsize)
         mngr = fig.canvas.manager
-        if saved_geom:
-            mngr.window.setGeometry(saved_geom)
+        if isinstance(saved_geom, list):
+            mngr.window.setGeometry(*saved_geom)
         ax = fig.add_subplot(111)
         line_objects = dict()
         self.figure_list.append(fig)
         ts0 = self.initial_timestamp
         while self.running:
-            data = {
-                k: self.logged_data_fromtimestamp(k, last_update[k]) for k in varnames
-            }
+            data = dict()
+            for k in varnames:
+                data[k] = await self.run_reader(
+                    self.logged_data_fromtimestamp, k, last_update[k]
+                )
             if xymode:
                 ts_x, vs_x = data[x]
                 ts_y, vs_y = data[y]
@@ -673,11 +1623,9 @@ class AsyncSession:
 
         # Saving figure positions
         try:
-            geom = mngr.window.geometry()
-            figsize = tuple(fig.get_size_inches())
-            self.save_parameter(
-                **{param_key_window: str(geom), param_key_figsize: str(figsize)}
-            )
+            geom = list(mngr.window.geometry().getRect())
+            figsize = fig.get_size_inches().tolist()
+            self.save_parameter(**{param_key_window: geom, param_key_figsize: figsize})
         except AttributeError:
             pass
 
@@ -747,7 +1695,8 @@ class AsyncSession:
         return web.json_response(data)
 
     async def server_get_parameters(self, request):
-        params = {k: v for k, v in self.parameters().items() if not k.startswith("_")}
+        params = await self.run_reader(self.parameters)
+        params = {k: v for k, v in params.items() if not k.startswith("_")}
         return web.json_response(params)
 
     async def server_plot_page(self, request):
@@ -756,14 +1705,164 @@ class AsyncSession:
         response = aiohttp_jinja2.render_template("plot.html", request, context)
         return response
 
+    async def coalesced_data_fromtimestamp(self, name, timestamp):
+        """
+        Awaitable logged_data_fromtimestamp for the web server. Concurrent
+        calls for the same variable share a single query, from the start
+        of the query_bucket long interval of timestamp, and its result is
+        kept until the next write.
+        """
+        start = np.floor(timestamp / self.query_bucket) * self.query_bucket
+        key = (name, start)
+        future = self._query_cache.get(key)
+        if future is None:
+            future = asyncio.ensure_future(
+                self.run_reader(self.logged_data_fromtimestamp, name, start)
+            )
+            self._query_cache[key] = future
+
+            def forget(f):
+                if f.cancelled() or f.exception() is not None:
+                    if self._query_cache.get(key) is f:
+                        del self._query_cache[key]
+
+            future.add_done_callback(forget)
+        t, v = await asyncio.shield(future)
+        i = np.searchsorted(t, timestamp, side="right")
+        return t[i:], v[i:]
+
     async def server_data_from_ts(self, request):
         data_in = await request.json()
         last_ts = data_in["last_ts"]
         name = data_in["name"]
-        timestamps, values = self.logged_data_fromtimestamp(name, last_ts)
-        data_out = list(zip(timestamps, values))
-        # print('from', last_ts, data_out)
-        return web.json_response(data_out)
+        timestamps, values = await self.coalesced_data_fromtimestamp(name, last_ts)
+        return self._data_response(request, timestamps, values)
+
+    def _data_response(self, request, timestamps, values):
+        """
+        Response with timestamps and values, in the binary columns format if
+        the client accepts it, and as a JSON list of [timestamp, value]
+        otherwise.
+        """
+        if _COLUMNS_MEDIA_TYPE in request.headers.get("Accept", "") and (
+            values.dtype.kind == "f"
+        ):
+            return web.Response(
+                body=_encode_columns(timestamps, values),
+                content_type=_COLUMNS_MEDIA_TYPE,
+            )
+        return web.json_response(list(zip(timestamps.tolist(), values.tolist())))
+
+    async def server_stream(self, request):
+        """
+        WebSocket endpoint which pushes the new log entries to the client.
+        The client first sends {"names": [...], "last_ts": ts}. names
+        defaults to all the variables. The data after last_ts, or the last
+        values if last_ts is not given, is sent first. Then each message
+        maps names to the [timestamp, value] pairs added since the previous
+        message.
+        """
+        ws = web.WebSocketResponse(heartbeat=30.0)
+        await ws.prepare(request)
+        data_in = await ws.receive_json()
+        names = data_in.get("names")
+        last_ts = data_in.get("last_ts")
+        subscriber = _StreamSubscriber(names)
+        self._subscribers.add(subscriber)
+
+        async def sender():
+            if last_ts is None:
+                data = {
+                    name: [list(v)]
+                    for name, v in self.logged_last_values().items()
+                    if names is None or name in names
+                }
+            else:
+                data = dict()
+                for name in self.logged_variables() if names is None else names:
+                    t, v = await self.coalesced_data_fromtimestamp(name, last_ts)
+                    data[name] = list(zip(t.tolist(), v.tolist()))
+            await ws.send_json(data)
+            while self.running and not ws.closed:
+                try:
+                    await asyncio.wait_for(subscriber.event.wait(), 1.0)
+                except asyncio.TimeoutError:
+                    continue
+                await ws.send_json(subscriber.pop())
+            await ws.close()
+
+        task = asyncio.ensure_future(sender())
+        try:
+            async for msg in ws:
+                pass
+        finally:
+            self._subscribers.discard(subscriber)
+            task.cancel()
+        return ws
+
+    async def server_data_range(self, request):
+        data_in = await request.json()
+        timestamps, values = await self.run_reader(
+            self.logged_data_range,
+            data_in["name"],
+            data_in.get("t_start"),
+            data_in.get("t_end"),
+            data_in.get("max_points"),
+            data_in.get("method", "minmax"),
+        )
+        return self._data_response(request, timestamps, values)
+
+    async def server_data_batch(self, request):
+        """
+        Returns the data of several variables in one response. The request
+        may specify names, t_start, t_end, max_points and method, as for
+        logged_data_batch, or since, which maps each name to the timestamp
+        after which its data is returned, as for logged_data_fromtimestamp.
+        The response maps each name to a list of [timestamp, value], or, if
+        align is true, is {"time": [...], "values": {name: [...]}} with null
+        where a variable has no value at a timestamp. Numeric data which is
+        not aligned is sent in the binary columns format if the client
+        accepts it.
+        """
+        data_in = await request.json()
+        since = data_in.get("since")
+        if since is not None:
+            data = dict()
+            for name, timestamp in since.items():
+                data[name] = await self.run_reader(
+                    self.logged_data_fromtimestamp, name, timestamp
+                )
+        else:
+            data = await self.run_reader(
+                self.logged_data_batch,
+                data_in.get("names"),
+                data_in.get("t_start"),
+                data_in.get("t_end"),
+                data_in.get("max_points"),
+                data_in.get("method", "minmax"),
+            )
+        if not data_in.get("align"):
+            if _COLUMNS_MEDIA_TYPE in request.headers.get("Accept", "") and all(
+                v.dtype.kind == "f" for t, v in data.values()
+            ):
+                return web.Response(
+                    body=_encode_columns_batch(data), content_type=_COLUMNS_MEDIA_TYPE
+                )
+            return web.json_response(
+                {
+                    name: list(zip(t.tolist(), v.tolist()))
+                    for name, (t, v) in data.items()
+                }
+            )
+        t_all = np.unique(np.concatenate([t for t, v in data.values()] + [[]]))
+        values = dict()
+        for name, (t, v) in data.items():
+            aligned = [None] * t_all.size
+            for i, val in zip(np.searchsorted(t_all, t).tolist(), v.tolist()):
+                if val == val:
+                    aligned[i] = val
+            values[name] = aligned
+        return web.json_response({"time": t_all.tolist(), "values": values})
 
     async def server_current_ts(self, request):
         return web.json_response({"now": datetime.now().timestamp()})
@@ -774,6 +1873,30 @@ class AsyncSession:
             await corofunc(self)
         print("Task finished", corofunc)
 
+    def web_application(self, custom_routes=None, **kwargs):
+        """
+        Returns the aiohttp application of the web server of run
+        """
+        app = web.Application(middlewares=[_compress_json], **kwargs)
+        aiohttp_jinja2.setup(app, loader=self.jinja2_loader)
+        app.router.add_routes(
+            [
+                web.get("/", self.server_main_page),
+                web.get("/api/logged_last_values", self.server_logged_last_values),
+                web.get("/plot/{name}", self.server_plot_page),
+                web.static("/static", self.static_dir),
+                web.post("/api/data_from_ts", self.server_data_from_ts),
+                web.post("/api/data_range", self.server_data_range),
+                web.post("/api/data_batch", self.server_data_batch),
+                web.get("/api/stream", self.server_stream),
+                web.get("/api/server_current_ts", self.server_current_ts),
+                web.get("/api/get_parameters", self.server_get_parameters),
+            ]
+        )
+        if custom_routes:
+            app.router.add_routes(custom_routes)
+        return app
+
     def run(self, *tasks, server_port=6913, custom_routes=None, custom_figures=None):
         loop = asyncio.get_event_loop()
         self.custom_figures = custom_figures
@@ -789,22 +1912,7 @@ class AsyncSession:
 
         # web server
         if server_port:
-            app = web.Application(loop=loop)
-            aiohttp_jinja2.setup(app, loader=self.jinja2_loader)
-            app.router.add_routes(
-                [
-                    web.get("/", self.server_main_page),
-                    web.get("/api/logged_last_values", self.server_logged_last_values),
-                    web.get("/plot/{name}", self.server_plot_page),
-                    web.static("/static", self.static_dir),
-                    web.post("/api/data_from_ts", self.server_data_from_ts),
-                    web.get("/api/server_current_ts", self.server_current_ts),
-                    web.get("/api/get_parameters", self.server_get_parameters),
-                ]
-            )
-            if custom_routes:
-                app.router.add_routes(custom_routes)
-
+            app = self.web_application(custom_routes, loop=loop)
             webserver = loop.create_server(
                 app.make_handler(), host=None, port=server_port
             )
@@ -819,15 +1927,26 @@ class AsyncSession:
                 tasks_final.append(t)
             else:
                 raise TypeError("Coroutine or Coroutinefunction is expected")
+        if self.write_behind:
+            tasks_final.append(self.write_behind_flush())
+        if self.delay_save and self.checkpoint_interval:
+            tasks_final.append(self.checkpoint_task())
+        if self.memory_budget is not None:
+            tasks_final.append(self.spill_task())
+        tasks_final.append(self.ingest_task())
+        self.start_readers()
         print("Starting event loop")
-        if server_port:
-            loop.run_until_complete(
-                asyncio.gather(webserver, self.figure_gui_update(), *tasks_final)
-            )
-        else:
-            loop.run_until_complete(
-                asyncio.gather(self.figure_gui_update(), *tasks_final)
-            )
+        try:
+            if server_port:
+                loop.run_until_complete(
+                    asyncio.gather(webserver, self.figure_gui_update(), *tasks_final)
+                )
+            else:
+                loop.run_until_complete(
+                    asyncio.gather(self.figure_gui_update(), *tasks_final)
+                )
+        finally:
+            self.stop_readers()
 
     def save_remote_data(self, data):
         """
@@ -859,63 +1978,153 @@ class AsyncSession:
                     self.save_parameter(**{k: v})
 
 
+class IngestionClient:
+    """
+    Client which logs into an AsyncSession from other threads or processes,
+    see AsyncSession.ingestion_client. The records are put in a queue, and
+    written in batches by the thread of the session.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def add_entry(self, **kwargs):
+        ts = datetime.now().timestamp()
+        self.queue.put(("E", [(ts, key, _real(val)) for key, val in kwargs.items()]))
+
+    def add_entries(self, name, timestamps, values):
+        self.add_entries_multi(timestamps, **{name: values})
+
+    def add_entries_multi(self, timestamps, **kwargs):
+        self.queue.put(("E", _multi_entries(timestamps, kwargs)))
+
+    def add_group_entry(self, group, **kwargs):
+        ts = datetime.now().timestamp()
+        names = tuple(kwargs)
+        row = (ts,) + tuple(_real(kwargs[key]) for key in names)
+        self.queue.put(("G", (group, names, [row])))
+
+    def add_dataset(self, **kwargs):
+        # encoded now, so that arrays modified afterwards are saved as they were
+        ts = datetime.now().timestamp()
+        self.queue.put(
+            ("D", [(ts, key, _encode_dataset(val)) for key, val in kwargs.items()])
+        )
+
+    def save_parameter(self, **kwargs):
+        self.queue.put(("P", kwargs))
+
+
 class RemoteObserver:
     """
-    Remote observation of a running async session
+    Remote observation of a running async session. The requests share a
+    requests.Session, so that its connections are reused.
+
+    By default, the data is downloaded by stop_recording. If an interval is
+    passed to start_recording, the new data is pulled every interval
+    seconds in a background thread while recording, so that stop_recording
+    only downloads the last points.
     """
 
     def __init__(self, host, port=6913):
         self.host = host
         self.port = port
+        self.session = requests.Session()
+        self._poller = None
 
-    def _get_request(self, apiname):
-        url = "http://{host:}:{port:}/api/{api:}".format(
-            host=self.host, port=self.port, api=apiname
-        )
-        r = requests.get(url)
-        try:
-            return r.json()
-        except json.decoder.JSONDecodeError:
-            print(r.text)
-            raise
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, cb):
+        self.close()
+
+    def close(self):
+        self._stop_poller()
+        self.session.close()
 
-    def _post_request(self, apiname, params):
-        url = "http://{host:}:{port:}/api/{api:}".format(
+    def _stop_poller(self):
+        if self._poller is not None:
+            self._stop_polling.set()
+            self._poller.join()
+            self._poller = None
+
+    def _url(self, apiname):
+        return "http://{host:}:{port:}/api/{api:}".format(
             host=self.host, port=self.port, api=apiname
         )
-        r = requests.post(url, json=params)
+
+    def _get_request(self, apiname):
+        r = self.session.get(self._url(apiname))
         try:
             return r.json()
         except json.decoder.JSONDecodeError:
             print(r.text)
             raise
 
-    def get_last_values(self):
+    def _data_from_ts(self, name, last_ts):
         """
-        Client function to grab the last set of values from
-        a remote running async session
+        Returns the arrays of timestamps and values of variable name after
+        last_ts, in the binary columns format if the server supports it
         """
+        r = self.session.post(
+            self._url("data_from_ts"),
+            json={"name": name, "last_ts": last_ts},
+            headers={"Accept": _COLUMNS_MEDIA_TYPE + ", application/json"},
+        )
+        r.raise_for_status()
+        if r.headers.get("Content-Type", "").startswith(_COLUMNS_MEDIA_TYPE):
+            return _decode_columns(r.content)
+        return _split_columns(r.json())
 
-        data = self._get_request("logged_last_values")
-        return {d["name"]: d["value"] for d in data}
-
-    def start_recording(self):
-        self.server_ts_start = self._get_request("server_current_ts")["now"]
-        data = self.get_last_values()
-        self.remote_varnames = list(data.keys())
-
-    def stop_recording(self, reduce_time=True, force_reduce_time=True):
+    def _fetch_recorded(self):
+        """
+        Returns the (timestamps, values) of each recorded variable which were
+        added since the last fetch, in a single request to the batch
+        endpoint, or with one request per variable for older servers, which
+        do not have it. Other error statuses raise requests.HTTPError.
+        """
+        r = self.session.post(
+            self._url("data_batch"),
+            json=self._batch_params(),
+            headers={"Accept": _COLUMNS_MEDIA_TYPE + ", application/json"},
+        )
+        if r.status_code == 404:
+            return {
+                name: self._data_from_ts(name, last_ts)
+                for name, last_ts in self._recorded_ts.items()
+            }
+        r.raise_for_status()
+        if r.headers.get("Content-Type", "").startswith(_COLUMNS_MEDIA_TYPE):
+            return _decode_columns_batch(r.content)
+        return {name: _split_columns(data) for name, data in r.json().items()}
+
+    def _batch_params(self):
+        # each variable is fetched from its own last timestamp, so that
+        # variables which are not updated do not hold the others back
+        return {"since": dict(self._recorded_ts)}
+
+    def _add_recorded(self, data):
+        for name, (t, v) in data.items():
+            keep = t > self._recorded_ts[name]
+            if keep.any():
+                self._recorded[name].append((t[keep], v[keep]))
+                self._recorded_ts[name] = t[keep][-1]
+
+    def _start_recording(self, server_ts_start, last_values):
+        self.server_ts_start = server_ts_start
+        self.remote_varnames = list(last_values.keys())
+        self._recorded = {name: list() for name in self.remote_varnames}
+        self._recorded_ts = {name: server_ts_start for name in self.remote_varnames}
+
+    def _recordings(self, parameters, reduce_time, force_reduce_time):
         recordings = dict()
-        for varname in self.remote_varnames:
-            data = self._post_request(
-                "data_from_ts",
-                params={"name": varname, "last_ts": self.server_ts_start},
-            )
-            if len(data) > 0:
+        for varname, chunks in self._recorded.items():
+            if chunks:
                 recordings[varname] = {
-                    "t": [d[0] for d in data],
-                    "value": [d[1] for d in data],
+                    "t": np.concatenate([t for t, v in chunks]).tolist(),
+                    "value": np.concatenate([v for t, v in chunks]).tolist(),
                 }
+        self._recorded = None
         if reduce_time:
             t = recordings[self.remote_varnames[0]]["t"]
             if (
@@ -932,11 +2141,147 @@ class RemoteObserver:
                         for varname in self.remote_varnames
                     }
                 )
-        parameters = self._get_request("get_parameters")
         recordings.update(parameters)
-
         return recordings
 
+    def get_last_values(self):
+        """
+        Client function to grab the last set of values from
+        a remote running async session
+        """
+
+        data = self._get_request("logged_last_values")
+        return {d["name"]: d["value"] for d in data}
+
+    def start_recording(self, interval=None):
+        self._stop_poller()
+        self._start_recording(
+            self._get_request("server_current_ts")["now"], self.get_last_values()
+        )
+        if interval is not None:
+            self._stop_polling = threading.Event()
+            self._poller = threading.Thread(
+                target=self._poll, args=(interval,), daemon=True
+            )
+            self._poller.start()
+
+    def _poll(self, interval):
+        while not self._stop_polling.wait(interval):
+            try:
+                self._add_recorded(self._fetch_recorded())
+            except (requests.RequestException, ValueError) as e:
+                # the next fetch gets the missed points
+                print("Remote fetch failed:", e)
+
+    def stop_recording(self, reduce_time=True, force_reduce_time=True):
+        self._stop_poller()
+        self._add_recorded(self._fetch_recorded())
+        parameters = self._get_request("get_parameters")
+        return self._recordings(parameters, reduce_time, force_reduce_time)
+
+
+class AsyncRemoteObserver(RemoteObserver):
+    """
+    Asynchronous version of RemoteObserver, whose requests share an
+    aiohttp.ClientSession, e.g.
+
+        async with AsyncRemoteObserver("mymachine") as obs:
+            await obs.start_recording(interval=10.0)
+            await asyncio.sleep(60.0)
+            data = await obs.stop_recording()
+
+    """
+
+    def __init__(self, host, port=6913):
+        self.host = host
+        self.port = port
+        self.session = None
+        self._poller = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type_, value, cb):
+        await self.close()
+
+    async def close(self):
+        await self._cancel_poller()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _cancel_poller(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+    def _client(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def _get_request(self, apiname):
+        async with self._client().get(self._url(apiname)) as r:
+            return await r.json()
+
+    async def _data_from_ts(self, name, last_ts):
+        async with self._client().post(
+            self._url("data_from_ts"),
+            json={"name": name, "last_ts": last_ts},
+            headers={"Accept": _COLUMNS_MEDIA_TYPE + ", application/json"},
+        ) as r:
+            r.raise_for_status()
+            if r.content_type == _COLUMNS_MEDIA_TYPE:
+                return _decode_columns(await r.read())
+            return _split_columns(await r.json())
+
+    async def _fetch_recorded(self):
+        async with self._client().post(
+            self._url("data_batch"),
+            json=self._batch_params(),
+            headers={"Accept": _COLUMNS_MEDIA_TYPE + ", application/json"},
+        ) as r:
+            if r.status != 404:
+                r.raise_for_status()
+                if r.content_type == _COLUMNS_MEDIA_TYPE:
+                    return _decode_columns_batch(await r.read())
+                data = await r.json()
+                return {name: _split_columns(d) for name, d in data.items()}
+        return {
+            name: await self._data_from_ts(name, last_ts)
+            for name, last_ts in self._recorded_ts.items()
+        }
+
+    async def get_last_values(self):
+        data = await self._get_request("logged_last_values")
+        return {d["name"]: d["value"] for d in data}
+
+    async def start_recording(self, interval=None):
+        await self._cancel_poller()
+        server_ts = await self._get_request("server_current_ts")
+        self._start_recording(server_ts["now"], await self.get_last_values())
+        if interval is not None:
+            self._poller = asyncio.ensure_future(self._poll(interval))
+
+    async def _poll(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self._add_recorded(await self._fetch_recorded())
+            except (aiohttp.ClientError, ValueError) as e:
+                # the next fetch gets the missed points
+                print("Remote fetch failed:", e)
+
+    async def stop_recording(self, reduce_time=True, force_reduce_time=True):
+        await self._cancel_poller()
+        self._add_recorded(await self._fetch_recorded())
+        parameters = await self._get_request("get_parameters")
+        return self._recordings(parameters, reduce_time, force_reduce_time)
+
 
 if __name__ == "__main__":
     with AsyncSession("Essai") as sesn:
@@ -0,0 +1,2309 @@
+"""
+
+This module defines the storage backends of AsyncSession. SQLiteBackend,
+the default, stores the session in an sqlite database, and BinaryBackend
+stores it in append-only binary files. A backend is selected with the
+backend argument of AsyncSession, e.g.
+
+    with AsyncSession(backend=BinaryBackend("mysession")) as sesn:
+        sesn.add_entry(a=1)
+
+"""
+
+import os
+import json
+import pickle
+import struct
+import zlib
+import lzma
+import itertools
+import functools
+import threading
+import sqlite3
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, unquote
+from urllib.request import pathname2url
+
+import numpy as np
+
+__all__ = ["StorageBackend", "SQLiteBackend", "BinaryBackend"]
+
+# Tables of memory_budget sessions whose rows are spilled to the database file
+_SPILLED_TABLES = ("log", "dataset", "dataset_chunks", "log_aggregate", "log_blocks")
+# Tables of memory_budget sessions which are copied in memory
+_COPIED_TABLES = (
+    "log_names",
+    "dataset_names",
+    "parameters",
+    "log_aggregate_levels",
+    "log_group_names",
+)
+_AGGREGATE_UPSERT = """
+ON CONFLICT (name, level, bucket) DO UPDATE SET
+n = n + excluded.n,
+vmin = min(vmin, excluded.vmin),
+vmax = max(vmax, excluded.vmax),
+vsum = vsum + excluded.vsum;
+"""
+# The upsert of the aggregates requires SQLite 3.24
+_AGGREGATE_SQLITE_VERSION = (3, 24, 0)
+_ARRAY_MAGIC = b"PYMANIPARRAY"
+_ARRAY_COMPRESSORS = {
+    None: (None, None),
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def _real(val):
+    """
+    Converts val as sqlite does when it is stored in a REAL column
+    """
+    if val is None or isinstance(val, bytes):
+        return val
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return val
+
+
+def _quote_name(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _encode_parameter(val):
+    """
+    Numbers are stored as REAL, other values as JSON in a BLOB, so that
+    strings are not converted by the REAL affinity of the column.
+    """
+    if isinstance(val, (int, float, np.number)) and not isinstance(val, bool):
+        return _real(val)
+    return json.dumps(val).encode("utf-8")
+
+
+def _decode_parameter(value):
+    if isinstance(value, bytes):
+        return json.loads(value.decode("utf-8"))
+    return value
+
+
+def _is_plain_array(val):
+    return (
+        isinstance(val, np.ndarray)
+        and not val.dtype.hasobject
+        and val.dtype.fields is None
+    )
+
+
+def _array_header(arr, compression=None, chunk_rows=None):
+    """
+    Magic string, length of the JSON header and JSON header which precede
+    the raw buffer of an array dataset.
+    """
+    header = json.dumps(
+        {
+            "dtype": arr.dtype.str,
+            "shape": arr.shape,
+            "compression": compression,
+            "chunk_rows": chunk_rows,
+        }
+    ).encode("ascii")
+    return b"".join((_ARRAY_MAGIC, struct.pack("<I", len(header)), header))
+
+
+def _parse_array_header(blob):
+    """
+    Returns the header of an array dataset blob, and the offset of the raw
+    buffer. The header is None for pickled values.
+    """
+    if not blob.startswith(_ARRAY_MAGIC):
+        return None, 0
+    start = len(_ARRAY_MAGIC) + 4
+    header_len, = struct.unpack_from("<I", blob, len(_ARRAY_MAGIC))
+    header = json.loads(bytes(blob[start : start + header_len]).decode("ascii"))
+    return header, start + header_len
+
+
+def _encode_dataset(val, compression=None):
+    """
+    Serializes a dataset value for the dataset table.
+    NumPy arrays with a plain dtype are stored as a magic string, the length
+    of a JSON header with dtype, shape and compression, the header, and
+    the raw (optionally compressed) buffer. Other objects are pickled.
+    """
+    if not _is_plain_array(val):
+        return pickle.dumps(val, protocol=4)
+    compress, _ = _ARRAY_COMPRESSORS[compression]
+    arr = np.ascontiguousarray(val)
+    raw = arr.reshape(-1).view(np.uint8)
+    if compress is not None:
+        raw = compress(raw)
+    return b"".join((_array_header(arr, compression), raw))
+
+
+def _decode_dataset(blob):
+    """
+    Deserializes a value stored by _encode_dataset. Uncompressed arrays are
+    read-only views on the blob, obtained with np.frombuffer without copy.
+    """
+    header, offset = _parse_array_header(blob)
+    if header is None:
+        return pickle.loads(blob)
+    raw = memoryview(blob)[offset:]
+    _, decompress = _ARRAY_COMPRESSORS[header["compression"]]
+    if decompress is not None:
+        raw = decompress(raw)
+    return np.frombuffer(raw, dtype=header["dtype"]).reshape(header["shape"])
+
+
+def _pack_log_block(t, v):
+    """
+    Lossless encoding of float64 timestamps and values: delta-of-delta of
+    the timestamp bits, XOR of consecutive value bits, then byte planes
+    compressed with zlib.
+    """
+    tb = np.diff(np.diff(t.view(np.int64), prepend=0), prepend=0)
+    vb = v.view(np.uint64)
+    vx = vb ^ np.concatenate((np.zeros(1, np.uint64), vb[:-1]))
+    planes = np.concatenate(
+        (tb.view(np.uint8).reshape((-1, 8)).T, vx.view(np.uint8).reshape((-1, 8)).T)
+    )
+    return zlib.compress(planes.tobytes())
+
+
+def _unpack_log_block(blob):
+    raw = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+    planes = raw.reshape((16, -1))
+    tb = np.ascontiguousarray(planes[:8].T).view(np.int64).ravel()
+    vx = np.ascontiguousarray(planes[8:].T).view(np.uint64).ravel()
+    t = np.cumsum(np.cumsum(tb)).view(np.float64)
+    v = np.bitwise_xor.accumulate(vx).view(np.float64)
+    return t, v
+
+
+def _rows_to_array(rows):
+    """
+    Decodes a list of (timestamp, value) rows into a (N, 2) float64 array.
+    NULL values are converted to NaN. Rows with text values are returned
+    in an array of the type numpy chooses for them.
+    """
+    try:
+        return np.fromiter(
+            itertools.chain.from_iterable(rows), dtype=np.float64, count=2 * len(rows)
+        ).reshape((-1, 2))
+    except (TypeError, ValueError):
+        # NULL or text values cannot be converted by fromiter
+        try:
+            return np.array(rows, dtype=np.float64)
+        except (TypeError, ValueError):
+            return np.array(rows)
+
+
+def _check_aggregate_support():
+    if sqlite3.sqlite_version_info < _AGGREGATE_SQLITE_VERSION:
+        raise RuntimeError(
+            "Aggregates require SQLite 3.24 or later, found {:}".format(
+                sqlite3.sqlite_version
+            )
+        )
+
+
+def _aggregate_buckets(t, v, level):
+    """
+    Returns the bucket numbers, counts, minimum, maximum and sum of the
+    values v at timestamps t, in buckets of duration level. NaN values
+    are ignored.
+    """
+    t, v = t[v == v], v[v == v]
+    buckets, inverse = np.unique((t // level).astype(np.int64), return_inverse=True)
+    n = np.bincount(inverse, minlength=buckets.size)
+    vsum = np.bincount(inverse, weights=v, minlength=buckets.size)
+    vmin = np.full(buckets.size, np.inf)
+    np.minimum.at(vmin, inverse, v)
+    vmax = np.full(buckets.size, -np.inf)
+    np.maximum.at(vmax, inverse, v)
+    return buckets, n, vmin, vmax, vsum
+
+
+class StorageBackend:
+    """
+    Interface of the storage backends of AsyncSession.
+    Log entries and datasets are lists of (timestamp, name, value) tuples,
+    and log data is returned as float64 arrays of timestamps and values,
+    sorted by timestamp, with NaN for missing values.
+
+    The methods which are not abstract are generic implementations, on top
+    of the abstract ones, which backends may override: grouped variables
+    are stored as separate entries, aggregates are computed from the raw
+    data when they are read, and dataset slices are taken from the whole
+    dataset. The group names and aggregate levels are saved as parameters.
+    The arrays of the dataset_compression dictionnary are compressed with
+    the given compression ("zlib" or "lzma").
+    """
+
+    # Executor of the threads with their own read connection, if any
+    reader_pool = None
+    # True if the storage was created when the backend was opened
+    created = False
+    # True if the data is kept in memory, and saved by the checkpoints
+    delay_save = False
+    # Size in bytes above which the data kept in memory is spilled, if any
+    memory_budget = None
+    # Size in bytes above which arrays are stored in chunks, if any
+    dataset_chunk_size = None
+    # True if only numeric (or None) values can be logged
+    numeric_only = False
+
+    def __init__(self):
+        self.dataset_compression = dict()
+
+    def get_version(self):
+        """
+        Returns the version of the storage format, if it has one
+        """
+        return None
+
+    def add_entries(self, entries):
+        raise NotImplementedError()
+
+    def write(self, entries=(), groups=(), datasets=(), parameters=None):
+        """
+        Writes entries, rows of grouped variables as (group, names, rows)
+        tuples, datasets and parameters, e.g. the pending records of a
+        write-behind session.
+        """
+        if entries:
+            self.add_entries(entries)
+        for group, names, rows in groups:
+            self.add_group_rows(group, names, rows)
+        if datasets:
+            self.add_datasets(datasets)
+        if parameters:
+            self.save_parameters(parameters)
+
+    def log_groups(self):
+        """
+        Returns the group of each grouped variable
+        """
+        return dict(self.parameter("_log_groups") or {})
+
+    def declare_group(self, group, names):
+        """
+        Adds new variables to group
+        """
+        groups = self.log_groups()
+        groups.update((key, group) for key in names)
+        self.save_parameters({"_log_groups": groups})
+
+    def add_group_rows(self, group, names, rows):
+        """
+        Logs a list of (timestamp, value1, value2, ...) rows of the given
+        variables of group. Missing (None) values are not logged.
+        """
+        self.add_entries(
+            [
+                (row[0], key, val)
+                for row in rows
+                for key, val in zip(names, row[1:])
+                if val is not None
+            ]
+        )
+
+    def read_log(
+        self, name, t_start=None, t_end=None, include_start=True, skip_null=False
+    ):
+        """
+        Returns the timestamps and values of variable name between t_start
+        and t_end (included). t_start is excluded if include_start is False,
+        and missing values if skip_null is True.
+        """
+        raise NotImplementedError()
+
+    def iter_log(self, name, chunk_size, timestamp=None):
+        """
+        Generator of the (timestamps, values) of variable name after
+        timestamp, by chunks of at most chunk_size points
+        """
+        t, v = self.read_log(name, timestamp, include_start=False)
+        for i in range(0, t.size, chunk_size):
+            yield t[i : i + chunk_size], v[i : i + chunk_size]
+
+    def tail_start(self, name, n):
+        """
+        Returns the timestamp of the n-th last value of variable name,
+        or None if less than n values are logged.
+        """
+        t, v = self.read_log(name, skip_null=True)
+        return t[-n].item() if t.size >= n else None
+
+    def log_time_range(self, name):
+        """
+        Returns the first and last timestamps of variable name, or None
+        """
+        t, v = self.read_log(name, skip_null=True)
+        if not t.size:
+            return None
+        return t[0].item(), t[-1].item()
+
+    def read_log_extrema(self, name, t_start, t_end, n_buckets, min_count):
+        """
+        Returns the timestamps and values of the points of minimum and
+        maximum value of n_buckets time buckets between t_start and t_end,
+        sorted by timestamp, or None if the range has at most min_count
+        points. Backends which cannot select them without reading the whole
+        range return None.
+        """
+        return None
+
+    def logged_variables(self):
+        raise NotImplementedError()
+
+    def first_values(self):
+        """
+        Returns the first (timestamp, value) of each logged variable
+        """
+        raise NotImplementedError()
+
+    def last_values(self):
+        """
+        Returns the last (timestamp, value) of each logged variable
+        """
+        raise NotImplementedError()
+
+    def aggregate_levels(self):
+        """
+        Returns the sorted list of the aggregate levels
+        """
+        return sorted(self.parameter("_aggregate_levels") or [])
+
+    def enable_aggregates(self, levels):
+        levels = set(self.aggregate_levels()).union(levels)
+        self.save_parameters({"_aggregate_levels": sorted(levels)})
+
+    def read_aggregates(self, name, level, t_start=None, t_end=None):
+        """
+        Returns the start time, number of points, minimum, maximum and mean
+        of the buckets of duration level of variable name, between t_start
+        and t_end. The first and last buckets may include points outside of
+        the range.
+        """
+        if t_start is not None:
+            t_start = t_start // level * level
+        if t_end is not None:
+            t_end = (t_end // level + 1) * level
+        t, v = self.read_log(name, t_start, t_end, skip_null=True)
+        if t_end is not None:
+            t, v = t[t < t_end], v[t < t_end]
+        buckets, n, vmin, vmax, vsum = _aggregate_buckets(t, v, level)
+        return buckets * level, n.astype(np.float64), vmin, vmax, vsum / n
+
+    def enable_log_blocks(self, block_size):
+        raise NotImplementedError("Log blocks are not supported by this backend")
+
+    def compact(self, max_age=None, bucket=60.0, keep_datasets=None, vacuum=True):
+        raise NotImplementedError("Compaction is not supported by this backend")
+
+    def add_datasets(self, datasets):
+        raise NotImplementedError()
+
+    def dataset_names(self):
+        raise NotImplementedError()
+
+    def dataset_times(self, name):
+        raise NotImplementedError()
+
+    def last_dataset_timestamp(self):
+        """
+        Returns the timestamp of the latest dataset, or None
+        """
+        times = [self.dataset_times(name)[-1:] for name in self.dataset_names()]
+        times = [t[0] for t in times if len(t)]
+        return max(times) if times else None
+
+    def iter_datasets(self, name):
+        """
+        Generator of the (timestamp, value) of the datasets of name
+        """
+        for ts in self.dataset_times(name):
+            yield ts, self.read_dataset(name, ts)
+
+    def read_dataset(self, name, ts):
+        raise NotImplementedError()
+
+    def dataset_slice(self, name, ts, start=None, stop=None):
+        return self.read_dataset(name, ts)[start:stop]
+
+    def load_parameters(self):
+        raise NotImplementedError()
+
+    def parameter(self, name):
+        """
+        Returns the value of parameter name, or None
+        """
+        return self.load_parameters().get(name)
+
+    def save_parameters(self, params):
+        raise NotImplementedError()
+
+    def memory_usage(self):
+        """
+        Returns the size in bytes of the data kept in memory
+        """
+        return 0
+
+    def start_readers(self, threads):
+        """
+        Starts the reader_pool of threads, if the backend supports
+        concurrent reads
+        """
+        pass
+
+    def stop_readers(self):
+        pass
+
+    def in_reader_thread(self):
+        """
+        Returns True if called from a thread of the reader_pool
+        """
+        return False
+
+    def checkpoint(self):
+        """
+        Generator of the steps of a periodic save of the data kept in
+        memory. None steps only let the caller run other tasks, and the
+        other steps are functions which may run in another thread.
+        """
+        return iter(())
+
+    def spill_batches(self):
+        """
+        Generator which moves data kept in memory to the storage, by
+        batches, while it exceeds the memory budget of the backend
+        """
+        return iter(())
+
+    def save_database(self):
+        self.flush()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Storage of AsyncSession in a sqlite database, the default.
+
+    If delay_save is True, the database is kept in memory, and saved to the
+    file <session_name>.db by save_database and the checkpoints, with the
+    sqlite online backup API by steps of checkpoint_pages pages.
+
+    Arrays larger than dataset_chunk_size bytes are saved uncompressed, in
+    chunks of the dataset_chunks table. Slices of them, and of the other
+    uncompressed arrays, are read without loading the whole dataset.
+
+    Once enable_aggregates has been called, count, min, max and sum of the
+    logged values are maintained in time buckets of several durations.
+
+    start_readers switches on-disk databases to WAL mode, and starts
+    reader threads with their own read-only connections, which are used
+    by the read methods called in these threads. Writes all go through the
+    main connection, from the thread which opened the backend.
+
+    If memory_budget is set (in bytes) for a delay_save session, only the
+    recent rows are kept in memory: when the in-memory database grows past
+    the budget, its rows older than spill_age seconds are moved to the
+    database file, by batches of spill_batch rows. The file is attached as
+    the "disk" schema, the log, dataset, dataset_chunks and log_aggregate
+    tables are read through temporary views of both schemas, and writes
+    explicitly target the main schema. If background_spill is True, the
+    writes do not spill, and spill_batches is called by a task of the owner
+    of the backend instead.
+
+    Variables which are grouped are logged in a single row of the
+    log_group_<group> table, with one column per variable.
+
+    Once enable_log_blocks has been called, the numeric values of each
+    (ungrouped) variable are packed in compressed blocks of the log_blocks
+    table, and the log table only holds the samples of the current block.
+    """
+
+    database_version = 9
+    dataset_chunk_size = 16 * 2 ** 20
+    spill_age = 60.0
+    spill_batch = 10000
+    background_spill = False
+
+    def __init__(
+        self,
+        session_name=None,
+        verbose=True,
+        delay_save=False,
+        checkpoint_pages=1024,
+        memory_budget=None,
+    ):
+        super().__init__()
+        self.delay_save = delay_save
+        self.checkpoint_pages = checkpoint_pages
+        self.memory_budget = memory_budget
+        self._reader_conns = list()
+        self._local = threading.local()
+        self._db_path = None
+        if session_name is not None:
+            session_name = str(session_name)  # in case it is a Path object
+            if session_name.endswith(".db"):
+                session_name = session_name[:-3]
+        elif delay_save:
+            raise ValueError("Cannot delay_save if session_name is not specified")
+        if memory_budget is not None and not delay_save:
+            raise ValueError("memory_budget requires delay_save")
+        if session_name is None or (delay_save and memory_budget is None):
+            # For no name session, or in case of delay_save=True, then
+            # the connection is in-memory. The sessions built in a thread
+            # can be closed from another one.
+            self.conn = sqlite3.connect(":memory:", check_same_thread=not delay_save)
+        else:
+            # Otherwise, the connection is on the disk for immediate writing.
+            # Memory budget sessions switch to memory once the file is ready.
+            self.conn = sqlite3.connect(session_name + ".db")
+            if not delay_save:
+                self._db_path = os.path.abspath(session_name + ".db")
+        if delay_save:
+            self._save_path = session_name + ".db"
+        if delay_save and memory_budget is None and os.path.exists(self._save_path):
+            # Load existing database into in-memory database
+            disk_db = sqlite3.connect(self._save_path)
+            try:
+                disk_db.backup(self.conn)
+            finally:
+                disk_db.close()
+        with self.conn as c:
+            tables = list(c.execute("SELECT name FROM sqlite_master;"))
+            if not tables:
+                self._create_schema(c)
+        self.created = not tables
+        self.upgrade_database(verbose=verbose and bool(tables))
+        if memory_budget is not None:
+            self._attach_disk()
+        with self.conn as c:
+            self._log_names = set(
+                [d[0] for d in c.execute("SELECT name FROM log_names;")]
+            )
+            self._dataset_names = set(
+                [d[0] for d in c.execute("SELECT name FROM dataset_names;")]
+            )
+            self._aggregate_levels = sorted(
+                [d[0] for d in c.execute("SELECT level FROM log_aggregate_levels;")]
+            )
+            if self._aggregate_levels:
+                _check_aggregate_support()
+            self._parameters = {
+                d[0]: _decode_parameter(d[1])
+                for d in c.execute("SELECT name, value FROM parameters;")
+            }
+            self._log_groups = dict(
+                c.execute("SELECT name, grp FROM log_group_names;").fetchall()
+            )
+            self._log_block_size = self._parameters.get("_log_block_size")
+            self._unpacked = dict()
+            if self._log_block_size:
+                self._count_unpacked(c)
+
+    def _create_schema(self, c):
+        """
+        Creates the tables and indexes of a new database, at the current
+        version.
+        """
+        c.execute("CREATE TABLE log_names (name TEXT);")
+        c.execute(
+            """
+            CREATE TABLE log (
+            timestamp INT,
+            name TEXT,
+            value REAL);
+            """
+        )
+        c.execute("CREATE INDEX log_name_timestamp ON log (name, timestamp);")
+        c.execute("CREATE TABLE dataset_names (name TEXT);")
+        c.execute(
+            """
+            CREATE TABLE dataset (
+            timestamp INT,
+            name TEXT,
+            data BLOB);
+            """
+        )
+        c.execute("CREATE INDEX dataset_name_timestamp ON dataset (name, timestamp);")
+        c.execute(
+            """
+            CREATE TABLE dataset_chunks (
+            timestamp INT,
+            name TEXT,
+            chunk INT,
+            data BLOB);
+            """
+        )
+        c.execute(
+            """
+            CREATE INDEX dataset_chunks_name_timestamp
+            ON dataset_chunks (name, timestamp, chunk);
+            """
+        )
+        c.execute(
+            """
+            CREATE TABLE parameters (
+                name TEXT,
+                value REAL);
+            """
+        )
+        c.execute("CREATE UNIQUE INDEX parameters_name ON parameters (name);")
+        c.execute("CREATE TABLE log_aggregate_levels (level REAL);")
+        c.execute(
+            """
+            CREATE TABLE log_aggregate (
+            name TEXT,
+            level REAL,
+            bucket INT,
+            n INT,
+            vmin REAL,
+            vmax REAL,
+            vsum REAL);
+            """
+        )
+        c.execute(
+            """
+            CREATE UNIQUE INDEX log_aggregate_bucket
+            ON log_aggregate (name, level, bucket);
+            """
+        )
+        c.execute("CREATE TABLE log_group_names (name TEXT, grp TEXT);")
+        c.execute(
+            """
+            CREATE TABLE log_blocks (
+            name TEXT,
+            t_first REAL,
+            t_last REAL,
+            n INT,
+            data BLOB);
+            """
+        )
+        c.execute("CREATE INDEX log_blocks_name_t_last ON log_blocks (name, t_last);")
+        c.execute(
+            "INSERT INTO parameters (name, value) VALUES (?,?);",
+            ("_database_version", self.database_version),
+        )
+
+    def get_version(self):
+        if hasattr(self, "_parameters"):
+            return self._parameters.get("_database_version", 1)
+        try:
+            row = self.conn.execute(
+                "SELECT value FROM parameters WHERE name=?;", ("_database_version",)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # version 1 files may lack the parameters table
+            row = None
+        if row is None:
+            return 1
+        return row[0]
+
+    def upgrade_database(self, verbose=True):
+        """
+        In-place migration of the database to the current version.
+        Version 1 to 3 files are brought to version 4 by creating the
+        missing tables and the (name, timestamp) indexes of the log and
+        dataset tables. Version 5 adds the dataset_chunks table,
+        version 6 the log_aggregate tables, version 7 a unique index
+        on the parameter names, version 8 the log_group_names table, and
+        version 9 the log_blocks table.
+        """
+        version = self.get_version()
+        if version >= self.database_version:
+            return
+        if verbose:
+            print(
+                "Upgrading database from version {:} to version {:}".format(
+                    version, self.database_version
+                )
+            )
+        with self.conn as c:
+            if version < 4:
+                c.execute("CREATE TABLE IF NOT EXISTS log_names (name TEXT);")
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS log (
+                    timestamp INT,
+                    name TEXT,
+                    value REAL);
+                    """
+                )
+                c.execute("CREATE TABLE IF NOT EXISTS dataset_names (name TEXT);")
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS dataset (
+                    timestamp INT,
+                    name TEXT,
+                    data BLOB);
+                    """
+                )
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS parameters (
+                        name TEXT,
+                        value REAL);
+                    """
+                )
+                c.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS log_name_timestamp
+                    ON log (name, timestamp);
+                    """
+                )
+                c.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS dataset_name_timestamp
+                    ON dataset (name, timestamp);
+                    """
+                )
+            if version < 5:
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS dataset_chunks (
+                    timestamp INT,
+                    name TEXT,
+                    chunk INT,
+                    data BLOB);
+                    """
+                )
+                c.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS dataset_chunks_name_timestamp
+                    ON dataset_chunks (name, timestamp, chunk);
+                    """
+                )
+            if version < 6:
+                c.execute(
+                    "CREATE TABLE IF NOT EXISTS log_aggregate_levels (level REAL);"
+                )
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS log_aggregate (
+                    name TEXT,
+                    level REAL,
+                    bucket INT,
+                    n INT,
+                    vmin REAL,
+                    vmax REAL,
+                    vsum REAL);
+                    """
+                )
+                c.execute(
+                    """
+                    CREATE UNIQUE INDEX IF NOT EXISTS log_aggregate_bucket
+                    ON log_aggregate (name, level, bucket);
+                    """
+                )
+            if version < 7:
+                c.execute(
+                    """
+                    DELETE FROM parameters WHERE rowid NOT IN (
+                        SELECT MAX(rowid) FROM parameters GROUP BY name);
+                    """
+                )
+                c.execute(
+                    """
+                    CREATE UNIQUE INDEX IF NOT EXISTS parameters_name
+                    ON parameters (name);
+                    """
+                )
+            if version < 8:
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS log_group_names (
+                    name TEXT,
+                    grp TEXT);
+                    """
+                )
+            if version < 9:
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS log_blocks (
+                    name TEXT,
+                    t_first REAL,
+                    t_last REAL,
+                    n INT,
+                    data BLOB);
+                    """
+                )
+                c.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS log_blocks_name_t_last
+                    ON log_blocks (name, t_last);
+                    """
+                )
+            c.execute("DELETE FROM parameters WHERE name=?;", ("_database_version",))
+            c.execute(
+                "INSERT INTO parameters (name, value) VALUES (?,?);",
+                ("_database_version", self.database_version),
+            )
+
+    def _attach_disk(self):
+        """
+        Switches a memory_budget session to an in-memory database, with the
+        database file attached as the "disk" schema. The schema and the
+        small tables are copied in memory, and temporary views of the
+        spilled tables, and of the tables of grouped variables, merge their
+        in-memory and on-disk rows.
+        """
+        self.conn.close()
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self.conn.execute("ATTACH DATABASE ? AS disk;", (self._save_path,))
+        with self.conn as c:
+            schema = c.execute(
+                """SELECT sql FROM disk.sqlite_master
+                   WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+                   ORDER BY type DESC;
+                """
+            ).fetchall()
+            for (sql,) in schema:
+                c.execute(sql)
+            for table in _COPIED_TABLES:
+                c.execute(
+                    "INSERT INTO main.{0:} SELECT * FROM disk.{0:};".format(table)
+                )
+            groups = c.execute("SELECT DISTINCT grp FROM disk.log_group_names;")
+            for table in _SPILLED_TABLES + tuple(
+                "log_group_" + group for (group,) in groups.fetchall()
+            ):
+                self._create_union_view(c, table)
+
+    def _create_union_view(self, c, table):
+        c.execute(
+            """
+            CREATE TEMP VIEW {0:} AS
+            SELECT * FROM disk.{0:} UNION ALL SELECT * FROM main.{0:};
+            """.format(
+                table
+            )
+        )
+
+    def save_database(self):
+        """
+        If delay_save = True, the database is kept in-memory, and later
+        saved to disk when this function is called.
+        The database file is overwritten with the content of the current
+        in-memory database with the sqlite online backup API, by steps of
+        checkpoint_pages pages. The file is left unchanged if the backup
+        is interrupted.
+        If memory_budget is set, the in-memory rows are spilled to the file
+        instead.
+        """
+        if self.memory_budget is not None:
+            self.spill()
+        elif self.delay_save:
+            self._backup_to_disk(self.conn)
+
+    def _backup_to_disk(self, conn):
+        disk_db = sqlite3.connect(self._save_path)
+        try:
+            conn.backup(disk_db, pages=self.checkpoint_pages)
+        finally:
+            disk_db.close()
+
+    def _save_snapshot(self, snapshot):
+        try:
+            self._backup_to_disk(snapshot)
+        finally:
+            snapshot.close()
+
+    def checkpoint(self):
+        """
+        Generator of the steps of a checkpoint of a delay_save session.
+        memory_budget sessions spill their in-memory rows by batches,
+        yielding None between them. The other sessions take a snapshot of the
+        in-memory database, and yield the function which saves it to the
+        database file and closes it, so that it can run in another thread
+        while the session keeps logging.
+        """
+        if self.memory_budget is not None:
+            while self.spill(batch_size=self.spill_batch):
+                yield None
+        elif self.delay_save:
+            snapshot = sqlite3.connect(":memory:", check_same_thread=False)
+            self.conn.backup(snapshot)
+            yield functools.partial(self._save_snapshot, snapshot)
+
+    def spill(self, cutoff=None, batch_size=None):
+        """
+        Moves the rows of the in-memory database of a memory_budget session
+        to the database file, and updates the copy of the small tables in
+        the file, in a single transaction. If cutoff is specified, only the
+        rows older than cutoff are moved, and if batch_size is specified,
+        at most the batch_size oldest rows of each table.
+        The pages freed in memory are reused by the new rows.
+        Returns the number of moved rows.
+        """
+        moved = 0
+        with self.conn as c:
+            if cutoff is None and batch_size is None:
+                for name in list(self._unpacked):
+                    self._pack_log(c, name, "main", 1)
+            for table in _COPIED_TABLES:
+                c.execute("DELETE FROM disk.{:};".format(table))
+                c.execute(
+                    "INSERT INTO disk.{0:} SELECT * FROM main.{0:};".format(table)
+                )
+            groups = set(self._log_groups.values())
+            for table in _SPILLED_TABLES + tuple("log_group_" + g for g in groups):
+                where, params = self._spilled_rows(table, cutoff, batch_size)
+                c.execute(
+                    "INSERT INTO disk.{0:} SELECT * FROM main.{0:} WHERE {1:}".format(
+                        table, where
+                    )
+                    + (
+                        _AGGREGATE_UPSERT
+                        if table == "log_aggregate" and self._aggregate_levels
+                        else ";"
+                    ),
+                    params,
+                )
+                moved += c.execute(
+                    "DELETE FROM main.{:} WHERE {:};".format(table, where), params
+                ).rowcount
+        return moved
+
+    def _spilled_rows(self, table, cutoff, batch_size):
+        """
+        Returns the condition, and its parameters, of the rows of table which
+        are moved by spill.
+        """
+        where, params = "1", ()
+        if cutoff is not None:
+            column = {
+                "log_aggregate": "(bucket + 1) * level",
+                "log_blocks": "t_last",
+            }.get(table, "timestamp")
+            where, params = "{:} < ?".format(column), (cutoff,)
+        if batch_size is not None:
+            where = """rowid IN (
+                SELECT rowid FROM main.{:} WHERE {:} ORDER BY rowid LIMIT ?)
+                """.format(
+                table, where
+            )
+            params += (batch_size,)
+        return where, params
+
+    def spill_batches(self):
+        """
+        Generator which spills the in-memory database of a memory_budget
+        session by batches of spill_batch rows while it exceeds the budget,
+        and yields after each batch. The rows older than spill_age seconds
+        are moved first, and the recent rows only if they alone exceed the
+        budget.
+        """
+        cutoff = datetime.now().timestamp() - self.spill_age
+        while self._memory_used() > self.memory_budget:
+            if not self.spill(cutoff, self.spill_batch):
+                if cutoff is None:
+                    return
+                cutoff = None
+            yield
+
+    def memory_usage(self):
+        """
+        Returns the size in bytes of the in-memory database, including the
+        free pages, or 0 if the database is on disk.
+        """
+        if self._db_path is not None:
+            return 0
+        page_size, = self.conn.execute("PRAGMA main.page_size;").fetchone()
+        page_count, = self.conn.execute("PRAGMA main.page_count;").fetchone()
+        return page_size * page_count
+
+    def _memory_used(self):
+        """
+        Returns the size in bytes of the used pages of the in-memory database
+        """
+        page_size, = self.conn.execute("PRAGMA main.page_size;").fetchone()
+        page_count, = self.conn.execute("PRAGMA main.page_count;").fetchone()
+        free, = self.conn.execute("PRAGMA main.freelist_count;").fetchone()
+        return (page_count - free) * page_size
+
+    def _check_memory_budget(self):
+        """
+        Spills the in-memory database if its used pages exceed memory_budget,
+        unless background_spill is set.
+        """
+        if self.memory_budget is None or self.background_spill:
+            return
+        for _ in self.spill_batches():
+            pass
+
+    def _reader_conn(self):
+        """
+        Connection used by the read methods: the read-only connection of the
+        current reader thread, or the main connection.
+        """
+        return getattr(self._local, "conn", self.conn)
+
+    def in_reader_thread(self):
+        return hasattr(self._local, "conn")
+
+    def _open_reader(self):
+        conn = sqlite3.connect(
+            "file:" + pathname2url(self._db_path) + "?mode=ro",
+            uri=True,
+            check_same_thread=False,
+        )
+        self._local.conn = conn
+        self._reader_conns.append(conn)
+
+    def start_readers(self, threads):
+        """
+        Switches the database to WAL mode and starts the reader_pool of
+        threads. This is a no-op for in-memory databases or if threads is 0.
+        """
+        if self.reader_pool is not None or not threads:
+            return
+        if self._db_path is None:
+            return
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.reader_pool = ThreadPoolExecutor(
+            threads,
+            thread_name_prefix="AsyncSession-reader",
+            initializer=self._open_reader,
+        )
+
+    def stop_readers(self):
+        """
+        Stops the reader threads, and switches the database back to the
+        rollback journal mode, so that the file can be copied alone.
+        """
+        if self.reader_pool is None:
+            return
+        self.reader_pool.shutdown()
+        self.reader_pool = None
+        for conn in self._reader_conns:
+            conn.close()
+        self._reader_conns = list()
+        self.conn.execute("PRAGMA journal_mode=DELETE;")
+
+    def write(self, entries=(), groups=(), datasets=(), parameters=None):
+        """
+        Writes entries, rows of grouped variables, datasets and parameters
+        in a single transaction
+        """
+        with self.conn as c:
+            if entries:
+                self._write_entries(c, entries)
+            for group, names, rows in groups:
+                self._write_group_rows(c, group, names, rows)
+            if datasets:
+                self._write_datasets(c, datasets)
+            if parameters:
+                self._write_parameters(c, parameters)
+        self._check_memory_budget()
+
+    def add_entries(self, entries):
+        self.write(entries=entries)
+
+    def _write_entries(self, c, entries):
+        """
+        Inserts a list of (timestamp, name, value) tuples in the log table
+        """
+        for ts, key, val in entries:
+            if key not in self._log_names:
+                c.execute("INSERT INTO log_names VALUES (?);", (key,))
+                self._log_names.add(key)
+        c.executemany("INSERT INTO main.log VALUES (?,?,?);", entries)
+        if self._aggregate_levels:
+            self._update_aggregates(c, entries)
+        if self._log_block_size:
+            for ts, key, val in entries:
+                self._unpacked[key] = self._unpacked.get(key, 0) + 1
+            for key, count in list(self._unpacked.items()):
+                if count >= self._log_block_size:
+                    self._pack_log(c, key)
+
+    def declare_group(self, group, names):
+        """
+        Creates the table of group, and the columns of its new variables
+        """
+        new = [key for key in names if key not in self._log_groups]
+        if not new:
+            return
+        table = "log_group_" + group
+        schemas = ("main",) if self.memory_budget is None else ("main", "disk")
+        with self.conn as c:
+            if self.memory_budget is not None:
+                c.execute("DROP VIEW IF EXISTS temp.{:};".format(table))
+            for schema in schemas:
+                c.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS {0:}.{1:} (
+                    timestamp INT);
+                    """.format(
+                        schema, table
+                    )
+                )
+                c.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS {0:}.{1:}_timestamp
+                    ON {1:} (timestamp);
+                    """.format(
+                        schema, table
+                    )
+                )
+                for key in new:
+                    c.execute(
+                        "ALTER TABLE {:}.{:} ADD COLUMN {:} REAL;".format(
+                            schema, table, _quote_name(key)
+                        )
+                    )
+            if self.memory_budget is not None:
+                self._create_union_view(c, table)
+            for key in new:
+                c.execute("INSERT INTO log_names VALUES (?);", (key,))
+                c.execute("INSERT INTO log_group_names VALUES (?,?);", (key, group))
+                self._log_names.add(key)
+                self._log_groups[key] = group
+
+    def add_group_rows(self, group, names, rows):
+        self.write(groups=[(group, names, rows)])
+
+    def _write_group_rows(self, c, group, names, rows):
+        """
+        Inserts a list of (timestamp, value1, value2, ...) tuples in the table
+        of group, whose columns are the given variable names.
+        """
+        c.executemany(
+            "INSERT INTO main.log_group_{:} (timestamp, {:}) VALUES (?{:});".format(
+                group, ", ".join(_quote_name(key) for key in names), ",?" * len(names)
+            ),
+            rows,
+        )
+        if self._aggregate_levels:
+            self._update_aggregates(
+                c,
+                [
+                    (row[0], key, val)
+                    for row in rows
+                    for key, val in zip(names, row[1:])
+                    if val is not None
+                ],
+            )
+
+    def add_datasets(self, datasets):
+        self.write(datasets=datasets)
+
+    def _write_datasets(self, c, datasets):
+        """
+        Inserts a list of (timestamp, name, value) datasets in the dataset
+        table. Large arrays are written in chunks.
+        """
+        for ts, key, val in datasets:
+            if key not in self._dataset_names:
+                c.execute("INSERT INTO dataset_names VALUES (?);", (key,))
+                self._dataset_names.add(key)
+            if (
+                _is_plain_array(val)
+                and val.ndim > 0
+                and val.nbytes > self.dataset_chunk_size
+            ):
+                self._write_chunked_dataset(c, ts, key, val)
+            else:
+                blob = _encode_dataset(val, self.dataset_compression.get(key))
+                c.execute("INSERT INTO main.dataset VALUES (?,?,?);", (ts, key, blob))
+
+    def _write_chunked_dataset(self, c, ts, name, arr):
+        """
+        Inserts the header of a large array in the dataset table, and its
+        raw buffer in the dataset_chunks table, by blocks of rows along the
+        first axis of about dataset_chunk_size bytes.
+        """
+        row_nbytes = arr.nbytes // arr.shape[0]
+        chunk_rows = max(1, self.dataset_chunk_size // row_nbytes)
+        c.execute(
+            "INSERT INTO main.dataset VALUES (?,?,?);",
+            (ts, name, _array_header(arr, chunk_rows=chunk_rows)),
+        )
+        for chunk, start in enumerate(range(0, arr.shape[0], chunk_rows)):
+            block = np.ascontiguousarray(arr[start : start + chunk_rows])
+            c.execute(
+                "INSERT INTO main.dataset_chunks VALUES (?,?,?,?);",
+                (ts, name, chunk, block.reshape(-1).view(np.uint8)),
+            )
+
+    def enable_log_blocks(self, block_size=4096):
+        """
+        Packs the numeric values of each variable, including the existing
+        ones, in compressed blocks of block_size samples. The timestamps
+        are delta-of-delta encoded and the values XOR-encoded before zlib
+        compression, so that no precision is lost. Samples of the block
+        being filled stay in the log table. Grouped variables are not
+        packed. This setting is saved in the database.
+        """
+        self.save_parameters({"_log_block_size": int(block_size)})
+        self._log_block_size = int(block_size)
+        schemas = ("main",) if self.memory_budget is None else ("main", "disk")
+        with self.conn as c:
+            self._count_unpacked(c)
+            for name in list(self._unpacked):
+                for schema in schemas:
+                    self._pack_log(c, name, schema)
+            self._count_unpacked(c)
+
+    def _count_unpacked(self, c):
+        self._unpacked = dict(
+            c.execute(
+                """SELECT name, COUNT(*) FROM log
+                   WHERE typeof(value) IN ('real', 'null')
+                   GROUP BY name;
+                """
+            ).fetchall()
+        )
+
+    def _pack_log(self, c, name, schema="main", min_rows=None):
+        """
+        Moves the oldest numeric log rows of variable name, by blocks of
+        _log_block_size rows, to the log_blocks table, as long as there are
+        at least min_rows rows (defaults to a full block).
+        """
+        if min_rows is None:
+            min_rows = self._log_block_size
+        while True:
+            rows = c.execute(
+                """SELECT timestamp, value FROM {:}.log
+                   WHERE name=? AND typeof(value) IN ('real', 'null')
+                   ORDER BY timestamp ASC
+                   LIMIT ?;
+                """.format(
+                    schema
+                ),
+                (name, self._log_block_size),
+            ).fetchall()
+            if len(rows) < min_rows or not rows:
+                self._unpacked[name] = len(rows)
+                return
+            data = np.array(
+                [(row[0], np.nan if row[1] is None else row[1]) for row in rows],
+                dtype=np.float64,
+            )
+            t, v = np.ascontiguousarray(data[:, 0]), np.ascontiguousarray(data[:, 1])
+            c.execute(
+                "INSERT INTO main.log_blocks VALUES (?,?,?,?,?);",
+                (name, t[0], t[-1], t.size, _pack_log_block(t, v)),
+            )
+            c.execute(
+                """DELETE FROM {0:}.log WHERE rowid IN (
+                       SELECT rowid FROM {0:}.log
+                       WHERE name=? AND typeof(value) IN ('real', 'null')
+                       ORDER BY timestamp ASC
+                       LIMIT ?);
+                """.format(
+                    schema
+                ),
+                (name, self._log_block_size),
+            )
+
+    def _update_aggregates(self, c, entries):
+        """
+        Adds the numeric entries to the log_aggregate buckets of each level
+        """
+        by_name = dict()
+        for ts, key, val in entries:
+            if isinstance(val, float) and val == val:
+                by_name.setdefault(key, list()).append((ts, val))
+        for key, data in by_name.items():
+            data = np.array(data, dtype=np.float64)
+            self._add_aggregates(c, key, data[:, 0], data[:, 1], self._aggregate_levels)
+
+    def _add_aggregates(self, c, name, t, v, levels):
+        """
+        Adds the timestamps t and values v of variable name to the
+        log_aggregate buckets of the given levels. NaN values are ignored.
+        """
+        if not (v == v).any():
+            return
+        rows = list()
+        for level in levels:
+            buckets, n, vmin, vmax, vsum = _aggregate_buckets(t, v, level)
+            rows.extend(
+                zip(
+                    itertools.repeat(name),
+                    itertools.repeat(level),
+                    buckets.tolist(),
+                    n.tolist(),
+                    vmin.tolist(),
+                    vmax.tolist(),
+                    vsum.tolist(),
+                )
+            )
+        c.executemany(
+            "INSERT INTO main.log_aggregate VALUES (?,?,?,?,?,?,?)" + _AGGREGATE_UPSERT,
+            rows,
+        )
+
+    def enable_aggregates(self, levels=(1.0, 60.0, 3600.0)):
+        """
+        Maintains count, min, max and sum of the logged values in buckets of
+        the given durations (in seconds). The buckets of new levels are
+        built from the existing data, including the values packed in log
+        blocks, then they are updated as entries are added. The levels are
+        saved in the database. This requires SQLite 3.24 or later.
+        """
+        _check_aggregate_support()
+        new = list()
+        with self.conn as c:
+            for level in levels:
+                level = float(level)
+                if level in self._aggregate_levels or level in new:
+                    continue
+                new.append(level)
+                c.execute("INSERT INTO log_aggregate_levels VALUES (?);", (level,))
+                c.execute(
+                    """
+                    INSERT INTO main.log_aggregate
+                    SELECT name, ?, CAST(timestamp / ? AS INT) AS bucket,
+                           COUNT(value), MIN(value), MAX(value), SUM(value)
+                    FROM log
+                    WHERE value IS NOT NULL AND typeof(value) = 'real'
+                    GROUP BY name, bucket;
+                    """,
+                    (level, level),
+                )
+                for name, group in self._log_groups.items():
+                    c.execute(
+                        """
+                        INSERT INTO main.log_aggregate
+                        SELECT ?, ?, CAST(timestamp / ? AS INT) AS bucket,
+                               COUNT({0:}), MIN({0:}), MAX({0:}), SUM({0:})
+                        FROM log_group_{1:}
+                        WHERE {0:} IS NOT NULL
+                        GROUP BY bucket;
+                        """.format(
+                            _quote_name(name), group
+                        ),
+                        (name, level, level),
+                    )
+            if new:
+                for name, blob in c.execute("SELECT name, data FROM log_blocks;"):
+                    t, v = _unpack_log_block(blob)
+                    self._add_aggregates(c, name, t, v, new)
+            self._aggregate_levels = sorted(self._aggregate_levels + new)
+
+    def aggregate_levels(self):
+        return list(self._aggregate_levels)
+
+    def read_aggregates(self, name, level, t_start=None, t_end=None):
+        """
+        Returns the start time, number of points, minimum, maximum and mean
+        of the buckets of duration level of variable name, between t_start
+        and t_end. The first and last buckets may include points outside of
+        the range.
+        """
+        if level not in self._aggregate_levels:
+            raise ValueError("No aggregate at level {:}".format(level))
+        where = "name=? AND level=?"
+        params = [name, level]
+        if t_start is not None:
+            where += " AND bucket >= ?"
+            params.append(int(t_start // level))
+        if t_end is not None:
+            where += " AND bucket <= ?"
+            params.append(int(t_end // level))
+        with self._reader_conn() as conn:
+            # buckets may be split between memory and disk (memory_budget)
+            data = conn.execute(
+                "SELECT bucket, SUM(n), MIN(vmin), MAX(vmax), SUM(vsum) "
+                "FROM log_aggregate WHERE "
+                + where
+                + " GROUP BY bucket ORDER BY bucket ASC;",
+                params,
+            ).fetchall()
+        data = np.array(data, dtype=np.float64).reshape((-1, 5))
+        n = data[:, 1]
+        return data[:, 0] * level, n, data[:, 2], data[:, 3], data[:, 4] / n
+
+    def logged_variables(self):
+        with self._reader_conn() as conn:
+            c = conn.cursor()
+            c.execute("SELECT name FROM log_names;")
+            data = c.fetchall()
+        names = set([d[0] for d in data])
+        return names
+
+    def log_groups(self):
+        return dict(self._log_groups)
+
+    def first_values(self):
+        return self._query_boundary_values("ASC")
+
+    def last_values(self):
+        return self._query_boundary_values("DESC")
+
+    def _query_boundary_values(self, order):
+        """
+        Returns the first (order="ASC") or last (order="DESC") timestamp and
+        value of each logged variable, with a single query on the
+        (name, timestamp) index.
+        """
+        with self._reader_conn() as conn:
+            c = conn.cursor()
+            c.execute(
+                """SELECT name, (
+                       SELECT timestamp FROM log AS l
+                       WHERE l.name = log_names.name
+                       ORDER BY l.timestamp {0:}
+                       LIMIT 1), (
+                       SELECT value FROM log AS l
+                       WHERE l.name = log_names.name
+                       ORDER BY l.timestamp {0:}
+                       LIMIT 1)
+                   FROM log_names;
+                """.format(
+                    order
+                )
+            )
+            values = {d[0]: (d[1], d[2]) for d in c.fetchall() if d[1] is not None}
+            for name in self._log_groups:
+                source, params = self._log_source(name)
+                row = c.execute(
+                    "SELECT timestamp, value FROM "
+                    + source
+                    + " ORDER BY timestamp {:} LIMIT 1;".format(order),
+                    params,
+                ).fetchone()
+                if row is not None:
+                    values[name] = row
+            if self._log_block_size:
+                for name in self._log_names.difference(self._log_groups):
+                    row = c.execute(
+                        "SELECT data FROM log_blocks WHERE name=? "
+                        "ORDER BY t_last {:} LIMIT 1;".format(order),
+                        (name,),
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    t, v = _unpack_log_block(row[0])
+                    i = 0 if order == "ASC" else -1
+                    if (
+                        name not in values
+                        or (order == "ASC" and t[i] < values[name][0])
+                        or (order == "DESC" and t[i] > values[name][0])
+                    ):
+                        values[name] = (t[i].item(), v[i].item())
+            return values
+
+    def _log_source(self, name):
+        """
+        Returns a subquery of the (timestamp, value) rows of variable name,
+        in the log table or in the table of its group, and its parameters.
+        """
+        group = self._log_groups.get(name)
+        if group is None:
+            return "(SELECT timestamp, value FROM log WHERE name=?)", (name,)
+        return (
+            "(SELECT timestamp, {0:} AS value FROM log_group_{1:} "
+            "WHERE {0:} IS NOT NULL)".format(_quote_name(name), group),
+            (),
+        )
+
+    def read_log(
+        self,
+        name,
+        t_start=None,
+        t_end=None,
+        include_start=True,
+        skip_null=False,
+        fetch_size=65536,
+    ):
+        """
+        Reads the timestamp and value columns of the rows of variable name
+        between t_start and t_end into preallocated float64 arrays,
+        fetch_size rows at a time. NULL values are returned as NaN, unless
+        skip_null is True. Values packed in blocks are decoded and merged.
+        """
+        source, params = self._log_source(name)
+        where = ["1"]
+        if skip_null:
+            where.append("value IS NOT NULL")
+        if t_start is not None:
+            where.append("timestamp >= ?" if include_start else "timestamp > ?")
+            params += (t_start,)
+        if t_end is not None:
+            where.append("timestamp <= ?")
+            params += (t_end,)
+        where = " AND ".join(where)
+        with self._reader_conn() as conn:
+            c = conn.cursor()
+            c.execute(
+                "SELECT COUNT(*) FROM " + source + " WHERE " + where + ";", params
+            )
+            count = c.fetchone()[0]
+            t = np.empty(count, dtype=np.float64)
+            v = np.empty(count, dtype=np.float64)
+            c.execute(
+                "SELECT timestamp, value FROM "
+                + source
+                + " WHERE "
+                + where
+                + " ORDER BY timestamp ASC;",
+                params,
+            )
+            i = 0
+            while i < count:
+                rows = c.fetchmany(min(fetch_size, count - i))
+                if not rows:
+                    break
+                block = _rows_to_array(rows)
+                if block.dtype != v.dtype and v.dtype == np.float64:
+                    # text values
+                    v = v.astype(object)
+                t[i : i + block.shape[0]] = block[:, 0]
+                v[i : i + block.shape[0]] = block[:, 1]
+                i += block.shape[0]
+        t, v = t[:i], v[:i]
+        if v.dtype == object:
+            v = np.array(v.tolist())
+        if self._log_block_size and name not in self._log_groups:
+            blocks = list(self._iter_log_blocks(name, t_start, t_end))
+            if blocks:
+                t = np.concatenate([b[0] for b in blocks] + [t])
+                v = np.concatenate([b[1] for b in blocks] + [v])
+                keep = np.ones(t.size, dtype=bool)
+                if skip_null:
+                    keep &= ~np.isnan(v)
+                if t_start is not None:
+                    keep &= t >= t_start if include_start else t > t_start
+                if t_end is not None:
+                    keep &= t <= t_end
+                t, v = t[keep], v[keep]
+                if (np.diff(t) < 0).any():
+                    order = np.argsort(t, kind="stable")
+                    t, v = t[order], v[order]
+        return t, v
+
+    def iter_log(self, name, chunk_size=100000, timestamp=None):
+        """
+        Generator of (timestamps, values) arrays of at most chunk_size points,
+        for processing very long variables out of core.
+        If timestamp is specified, only data after timestamp is returned.
+        """
+        if self._log_block_size and name not in self._log_groups:
+            for t, v in self._iter_log_blocks(name, timestamp):
+                keep = slice(None) if timestamp is None else t > timestamp
+                t, v = t[keep], v[keep]
+                for i in range(0, t.size, chunk_size):
+                    yield t[i : i + chunk_size], v[i : i + chunk_size]
+        source, params = self._log_source(name)
+        if timestamp is None:
+            where = "1"
+        else:
+            where, params = "timestamp > ?", params + (timestamp,)
+        c = self._reader_conn().cursor()
+        c.execute(
+            "SELECT timestamp, value FROM "
+            + source
+            + " WHERE "
+            + where
+            + " ORDER BY timestamp ASC;",
+            params,
+        )
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if not rows:
+                break
+            block = _rows_to_array(rows)
+            yield np.asarray(block[:, 0], dtype=np.float64), block[:, 1]
+
+    def _iter_log_blocks(self, name, t_start=None, t_end=None):
+        """
+        Generator of the decoded (timestamps, values) of the blocks of
+        variable name which overlap [t_start, t_end].
+        """
+        where, params = "name=?", [name]
+        if t_start is not None:
+            where += " AND t_last >= ?"
+            params.append(t_start)
+        if t_end is not None:
+            where += " AND t_first <= ?"
+            params.append(t_end)
+        rows = (
+            self._reader_conn()
+            .execute(
+                "SELECT data FROM log_blocks WHERE " + where + " ORDER BY t_last ASC;",
+                params,
+            )
+            .fetchall()
+        )
+        for (blob,) in rows:
+            yield _unpack_log_block(blob)
+
+    def tail_start(self, name, n):
+        """
+        Returns the timestamp of the n-th last value of variable name,
+        or None if less than n values are logged.
+        """
+        source, params = self._log_source(name)
+        with self._reader_conn() as conn:
+            row = conn.execute(
+                """SELECT timestamp FROM {:}
+                         WHERE value IS NOT NULL
+                         ORDER BY timestamp DESC
+                         LIMIT 1 OFFSET ?;
+                      """.format(
+                    source
+                ),
+                params + (n - 1,),
+            ).fetchone()
+        if row is not None:
+            return row[0]
+        if not self._log_block_size or name in self._log_groups:
+            return None
+        # the remaining values are in the blocks, from the newest one
+        with self._reader_conn() as conn:
+            n -= conn.execute(
+                "SELECT COUNT(*) FROM " + source + " WHERE value IS NOT NULL;", params
+            ).fetchone()[0]
+            it = conn.execute(
+                "SELECT data FROM log_blocks WHERE name=? ORDER BY t_last DESC;",
+                (name,),
+            )
+            for (blob,) in it:
+                t, v = _unpack_log_block(blob)
+                t = t[~np.isnan(v)]
+                if t.size >= n:
+                    return t[-n].item()
+                n -= t.size
+        return None
+
+    def log_time_range(self, name):
+        source, params = self._log_source(name)
+        with self._reader_conn() as conn:
+            first, last = conn.execute(
+                """SELECT (SELECT MIN(timestamp) FROM {0:}),
+                          (SELECT MAX(timestamp) FROM {0:});
+                """.format(
+                    source
+                ),
+                params + params,
+            ).fetchone()
+            if self._log_block_size:
+                block_first, block_last = conn.execute(
+                    "SELECT MIN(t_first), MAX(t_last) FROM log_blocks WHERE name=?;",
+                    (name,),
+                ).fetchone()
+                if block_first is not None:
+                    first = block_first if first is None else min(first, block_first)
+                    last = block_last if last is None else max(last, block_last)
+        if first is None:
+            return None
+        return first, last
+
+    def read_log_extrema(self, name, t_start, t_end, n_buckets, min_count):
+        """
+        Selects the points of minimum and maximum value of n_buckets time
+        buckets between t_start and t_end in the database, so that the whole
+        range is not loaded in memory. Returns None if the range has at most
+        min_count points or non-numeric values, or if values of name are
+        packed in log blocks.
+        """
+        if self._log_block_size and name not in self._log_groups:
+            return None
+        source, params = self._log_source(name)
+        where = ["value IS NOT NULL"]
+        if t_start is not None:
+            where.append("timestamp >= ?")
+            params += (t_start,)
+        if t_end is not None:
+            where.append("timestamp <= ?")
+            params += (t_end,)
+        where = " AND ".join(where)
+        with self._reader_conn() as conn:
+            count, first, last, text = conn.execute(
+                "SELECT COUNT(*), MIN(timestamp), MAX(timestamp), "
+                "SUM(typeof(value) != 'real') FROM {:} "
+                "WHERE {:};".format(source, where),
+                params,
+            ).fetchone()
+            if count <= min_count or text:
+                return None
+            width = (last - first) / n_buckets or 1.0
+            points = list()
+            for func in ("MIN", "MAX"):
+                # the timestamp is taken from the row of the minimum or maximum
+                points += conn.execute(
+                    """SELECT timestamp, {0:}(value),
+                              MIN(CAST((timestamp - ?) / ? AS INT), ?) AS bucket
+                       FROM {1:} WHERE {2:} GROUP BY bucket;
+                    """.format(
+                        func, source, where
+                    ),
+                    (first, width, n_buckets - 1) + params,
+                ).fetchall()
+        points = np.array(sorted(set(points)), dtype=np.float64)
+        return points[:, 0], points[:, 1]
+
+    def dataset_names(self):
+        with self._reader_conn() as conn:
+            c = conn.cursor()
+            try:
+                c.execute("SELECT name from dataset_names;")
+                data = c.fetchall()
+            except sqlite3.OperationalError:
+                return set()
+        return set([d[0] for d in data])
+
+    def dataset_times(self, name):
+        with self._reader_conn() as conn:
+            c = conn.cursor()
+            it = c.execute(
+                """SELECT timestamp FROM dataset
+                              WHERE name=?
+                              ORDER BY timestamp ASC;
+                           """,
+                (name,),
+            )
+            t = np.array([v[0] for v in it])
+        return t
+
+    def last_dataset_timestamp(self):
+        with self._reader_conn() as conn:
+            row = conn.execute("SELECT MAX(timestamp) FROM dataset;").fetchone()
+        return row[0]
+
+    def iter_datasets(self, name):
+        with self._reader_conn() as conn:
+            c = conn.cursor()
+            it = c.execute(
+                """SELECT timestamp, data FROM dataset
+                              WHERE name=?
+                              ORDER BY timestamp ASC;
+                           """,
+                (name,),
+            )
+            for row in it:
+                yield row[0], self._load_dataset(name, row[0], row[1])
+
+    def read_dataset(self, name, ts):
+        with self._reader_conn() as conn:
+            c = conn.cursor()
+            c.execute(
+                """SELECT data FROM dataset
+                         WHERE name=? AND timestamp=?;
+                      """,
+                (name, ts),
+            )
+            row = c.fetchone()
+            if row is None:
+                raise ValueError(f'No dataset "{name:}" at timestamp {ts:}')
+            data = self._load_dataset(name, ts, row[0])
+        return data
+
+    def _load_dataset(self, name, ts, blob):
+        header, offset = _parse_array_header(blob)
+        if header is None or not header.get("chunk_rows"):
+            return _decode_dataset(blob)
+        data = np.empty(header["shape"], dtype=header["dtype"])
+        raw = data.reshape(-1).view(np.uint8)
+        pos = 0
+        it = self._reader_conn().execute(
+            """SELECT data FROM dataset_chunks
+                     WHERE name=? AND timestamp=?
+                     ORDER BY chunk ASC;
+                  """,
+            (name, ts),
+        )
+        for (chunk_data,) in it:
+            raw[pos : pos + len(chunk_data)] = np.frombuffer(chunk_data, np.uint8)
+            pos += len(chunk_data)
+        return data
+
+    def dataset_slice(self, name, ts, start=None, stop=None):
+        """
+        Returns dataset(name, ts)[start:stop] for an array dataset.
+        For uncompressed arrays, only the requested rows are read from the
+        database, using incremental blob I/O when it is available.
+        """
+        schema, rowid = self._find_row("dataset", (name, ts))
+        if rowid is None:
+            raise ValueError(f'No dataset "{name:}" at timestamp {ts:}')
+        head = self._read_blob(schema, "dataset", rowid, 0, len(_ARRAY_MAGIC) + 4)
+        if not head.startswith(_ARRAY_MAGIC):
+            return self.read_dataset(name, ts)[start:stop]
+        header_len, = struct.unpack_from("<I", head, len(_ARRAY_MAGIC))
+        header, offset = _parse_array_header(
+            head + self._read_blob(schema, "dataset", rowid, len(head), header_len)
+        )
+        shape = header["shape"]
+        if header["compression"] is not None or not shape:
+            return self.read_dataset(name, ts)[start:stop]
+        dtype = np.dtype(header["dtype"])
+        start, stop, _ = slice(start, stop).indices(shape[0])
+        stop = max(start, stop)
+        row_nbytes = dtype.itemsize * int(np.prod(shape[1:]))
+        data = np.empty([stop - start] + shape[1:], dtype=dtype)
+        raw = data.reshape(-1).view(np.uint8)
+        chunk_rows = header.get("chunk_rows")
+        if not chunk_rows:
+            buf = self._read_blob(
+                schema, "dataset", rowid, offset + start * row_nbytes, raw.size
+            )
+            raw[:] = np.frombuffer(buf, np.uint8)
+            return data
+        pos = 0
+        for chunk in range(start // chunk_rows, (stop - 1) // chunk_rows + 1):
+            first = chunk * chunk_rows
+            i0 = max(start, first) - first
+            i1 = min(stop, first + chunk_rows) - first
+            chunk_schema, chunk_rowid = self._find_row(
+                "dataset_chunks", (name, ts, chunk)
+            )
+            buf = self._read_blob(
+                chunk_schema,
+                "dataset_chunks",
+                chunk_rowid,
+                i0 * row_nbytes,
+                (i1 - i0) * row_nbytes,
+            )
+            raw[pos : pos + len(buf)] = np.frombuffer(buf, np.uint8)
+            pos += len(buf)
+        return data
+
+    def _find_row(self, table, key):
+        """
+        Returns the schema and rowid of the dataset or dataset_chunks row
+        with the given (name, timestamp[, chunk]) key. Rows of memory_budget
+        sessions are either in memory or spilled to the "disk" schema.
+        """
+        where = "name=? AND timestamp=?"
+        if len(key) > 2:
+            where += " AND chunk=?"
+        schemas = ("main",) if self.memory_budget is None else ("main", "disk")
+        for schema in schemas:
+            row = (
+                self._reader_conn()
+                .execute(
+                    "SELECT rowid FROM {:}.{:} WHERE {:};".format(schema, table, where),
+                    key,
+                )
+                .fetchone()
+            )
+            if row is not None:
+                return schema, row[0]
+        return None, None
+
+    def _read_blob(self, schema, table, rowid, offset, length):
+        """
+        Reads length bytes at offset in the data column of a row. Incremental
+        blob I/O (Python 3.11+) avoids loading the rest of the blob.
+        """
+        if hasattr(self._reader_conn(), "blobopen"):
+            with self._reader_conn().blobopen(
+                table, "data", rowid, readonly=True, name=schema
+            ) as blob:
+                blob.seek(offset)
+                return blob.read(length)
+        row = (
+            self._reader_conn()
+            .execute(
+                "SELECT substr(data, ?, ?) FROM {:}.{:} WHERE rowid=?;".format(
+                    schema, table
+                ),
+                (offset + 1, length, rowid),
+            )
+            .fetchone()
+        )
+        return row[0]
+
+    def compact(self, max_age=None, bucket=60.0, keep_datasets=None, vacuum=True):
+        """
+        Reduces the size of the database.
+        Numeric log values older than max_age seconds are replaced by their
+        mean over buckets of the given duration (in seconds), placed at the
+        mean timestamp of the bucket. Only the buckets which end before the
+        cutoff, and which were not compacted yet, are averaged, so that
+        calling compact again does not average means with raw values.
+        The rows of grouped variables are averaged likewise. The blocks
+        with values before the cutoff are decoded, averaged together with
+        the log rows of their variable, and packed again.
+        The aggregates, if enabled, are kept, with the minimum and maximum
+        of the buckets.
+        If keep_datasets is specified, only the keep_datasets latest
+        datasets of each name are kept.
+        Finally, the database file is rebuilt with VACUUM.
+        """
+        if self.memory_budget is not None:
+            raise ValueError("Cannot compact a session with a memory_budget")
+        with self.conn as c:
+            if max_age is not None:
+                cutoff = (datetime.now().timestamp() - max_age) // bucket * bucket
+                since = self._parameters.get("_compacted_until", -np.inf)
+                if self._log_block_size:
+                    self._compact_log_blocks(c, since, cutoff, bucket)
+                c.execute(
+                    """
+                    CREATE TEMP TABLE log_compacted AS
+                    SELECT AVG(timestamp) AS mean_timestamp, name,
+                           AVG(value) AS mean_value,
+                           CAST(timestamp / ? AS INT) AS bucket
+                    FROM log
+                    WHERE timestamp >= ? AND timestamp < ?
+                    AND typeof(value) = 'real'
+                    GROUP BY name, bucket;
+                    """,
+                    (bucket, since, cutoff),
+                )
+                c.execute(
+                    """
+                    DELETE FROM log
+                    WHERE timestamp >= ? AND timestamp < ?
+                    AND typeof(value) = 'real';
+                    """,
+                    (since, cutoff),
+                )
+                c.execute(
+                    """
+                    INSERT INTO log
+                    SELECT mean_timestamp, name, mean_value
+                    FROM temp.log_compacted;
+                    """
+                )
+                c.execute("DROP TABLE temp.log_compacted;")
+                for group in set(self._log_groups.values()):
+                    columns = [
+                        _quote_name(name)
+                        for name, grp in self._log_groups.items()
+                        if grp == group
+                    ]
+                    c.execute(
+                        """
+                        CREATE TEMP TABLE log_compacted AS
+                        SELECT AVG(timestamp) AS timestamp, {1:}
+                        FROM log_group_{0:}
+                        WHERE timestamp >= ? AND timestamp < ?
+                        GROUP BY CAST(timestamp / ? AS INT);
+                        """.format(
+                            group,
+                            ", ".join(
+                                "AVG({0:}) AS {0:}".format(col) for col in columns
+                            ),
+                        ),
+                        (since, cutoff, bucket),
+                    )
+                    c.execute(
+                        """
+                        DELETE FROM log_group_{:}
+                        WHERE timestamp >= ? AND timestamp < ?;
+                        """.format(
+                            group
+                        ),
+                        (since, cutoff),
+                    )
+                    c.execute(
+                        """
+                        INSERT INTO log_group_{0:} (timestamp, {1:})
+                        SELECT timestamp, {1:} FROM temp.log_compacted;
+                        """.format(
+                            group, ", ".join(columns)
+                        )
+                    )
+                    c.execute("DROP TABLE temp.log_compacted;")
+                if cutoff > since:
+                    self._write_parameters(c, {"_compacted_until": cutoff})
+            if keep_datasets is not None:
+                for name in self._dataset_names:
+                    for table in ("dataset", "dataset_chunks"):
+                        c.execute(
+                            """
+                            DELETE FROM {:}
+                            WHERE name=? AND timestamp NOT IN (
+                                SELECT timestamp FROM dataset
+                                WHERE name=?
+                                ORDER BY timestamp DESC
+                                LIMIT ?);
+                            """.format(
+                                table
+                            ),
+                            (name, name, keep_datasets),
+                        )
+        if vacuum:
+            self.conn.execute("VACUUM;")
+
+    def _compact_log_blocks(self, c, since, cutoff, bucket):
+        """
+        Replaces the numeric values between since and cutoff of the log
+        blocks, and of the log rows of their variables, by their mean over
+        buckets, and packs them in new blocks.
+        """
+        names = [
+            row[0]
+            for row in c.execute(
+                """SELECT DISTINCT name FROM log_blocks
+                   WHERE t_last >= ? AND t_first < ?;
+                """,
+                (since, cutoff),
+            )
+        ]
+        for name in names:
+            blocks = c.execute(
+                """SELECT rowid, data FROM log_blocks
+                   WHERE name=? AND t_last >= ? AND t_first < ?;
+                """,
+                (name, since, cutoff),
+            ).fetchall()
+            rows = c.execute(
+                """SELECT timestamp, value FROM log
+                   WHERE name=? AND timestamp >= ? AND timestamp < ?
+                   AND typeof(value) = 'real';
+                """,
+                (name, since, cutoff),
+            ).fetchall()
+            decoded = [_unpack_log_block(blob) for _, blob in blocks]
+            rows = np.array(rows, dtype=np.float64).reshape((-1, 2))
+            t = np.concatenate([b[0] for b in decoded] + [rows[:, 0]])
+            v = np.concatenate([b[1] for b in decoded] + [rows[:, 1]])
+            averaged = (t >= since) & (t < cutoff) & (v == v)
+            buckets, inverse = np.unique(
+                (t[averaged] // bucket).astype(np.int64), return_inverse=True
+            )
+            n = np.bincount(inverse, minlength=buckets.size)
+            t_mean = np.bincount(inverse, weights=t[averaged]) / n
+            v_mean = np.bincount(inverse, weights=v[averaged]) / n
+            t = np.concatenate((t[~averaged], t_mean))
+            v = np.concatenate((v[~averaged], v_mean))
+            order = np.argsort(t, kind="stable")
+            t, v = t[order], v[order]
+            c.executemany(
+                "DELETE FROM log_blocks WHERE rowid=?;",
+                [(rowid,) for rowid, _ in blocks],
+            )
+            c.execute(
+                """DELETE FROM log
+                   WHERE name=? AND timestamp >= ? AND timestamp < ?
+                   AND typeof(value) = 'real';
+                """,
+                (name, since, cutoff),
+            )
+            for i in range(0, t.size, self._log_block_size):
+                tb = np.ascontiguousarray(t[i : i + self._log_block_size])
+                vb = np.ascontiguousarray(v[i : i + self._log_block_size])
+                c.execute(
+                    "INSERT INTO log_blocks VALUES (?,?,?,?,?);",
+                    (name, tb[0], tb[-1], tb.size, _pack_log_block(tb, vb)),
+                )
+        self._count_unpacked(c)
+
+    def load_parameters(self):
+        return dict(self._parameters)
+
+    def parameter(self, name):
+        return self._parameters.get(name)
+
+    def save_parameters(self, params):
+        self.write(parameters=params)
+
+    def _write_parameters(self, c, params):
+        rows = [(key, _encode_parameter(val)) for key, val in params.items()]
+        c.executemany(
+            """
+            INSERT OR REPLACE INTO parameters (name, value) VALUES (?,?);
+            """,
+            rows,
+        )
+        for key, value in rows:
+            self._parameters[key] = _decode_parameter(value)
+
+    def close(self):
+        self.stop_readers()
+        self.save_database()
+        self.conn.close()
+
+
+class BinaryBackend(StorageBackend):
+    """
+    Append-only storage in a directory. The samples of each variable are
+    appended as (timestamp, value) float64 pairs to log/<name>.f8, the
+    datasets of each name as (timestamp, length) prefixed records to
+    datasets/<name>.rec, and the parameters are saved in parameters.json.
+    Appends are buffered until flush, and an incomplete record at the end
+    of a file, e.g. after a crash, is ignored. Samples may be appended out
+    of order, they are sorted by timestamp when they are read. Only
+    numeric values can be logged, text values are rejected.
+    """
+
+    _record = struct.Struct("<dQ")
+    numeric_only = True
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = str(path)
+        self.created = not os.path.isdir(os.path.join(self.path, "log"))
+        os.makedirs(os.path.join(self.path, "log"), exist_ok=True)
+        os.makedirs(os.path.join(self.path, "datasets"), exist_ok=True)
+        self._log_files = dict()
+        self._dataset_files = dict()
+        self._dataset_index = dict()
+        self._parameters = dict()
+        params_path = os.path.join(self.path, "parameters.json")
+        if os.path.exists(params_path):
+            with open(params_path) as f:
+                self._parameters = json.load(f)
+
+    def _file_path(self, kind, name, ext):
+        return os.path.join(self.path, kind, quote(name, safe="") + ext)
+
+    def _names(self, kind, ext):
+        return set(
+            unquote(filename[: -len(ext)])
+            for filename in os.listdir(os.path.join(self.path, kind))
+            if filename.endswith(ext)
+        )
+
+    def add_entries(self, entries):
+        by_name = dict()
+        for ts, key, val in entries:
+            by_name.setdefault(key, list()).append((ts, np.nan if val is None else val))
+        for key, data in by_name.items():
+            f = self._log_files.get(key)
+            if f is None:
+                f = open(self._file_path("log", key, ".f8"), "ab")
+                self._log_files[key] = f
+            f.write(np.array(data, dtype="<f8").tobytes())
+
+    def _load_log(self, name):
+        self.flush()
+        path = self._file_path("log", name, ".f8")
+        if not os.path.exists(path):
+            return np.empty((0, 2))
+        data = np.fromfile(path, dtype="<f8")
+        return data[: data.size // 2 * 2].reshape((-1, 2))
+
+    def read_log(
+        self, name, t_start=None, t_end=None, include_start=True, skip_null=False
+    ):
+        data = self._load_log(name)
+        t, v = data[:, 0], data[:, 1]
+        if skip_null:
+            t, v = t[~np.isnan(v)], v[~np.isnan(v)]
+        if (np.diff(t) < 0).any():
+            order = np.argsort(t, kind="stable")
+            t, v = t[order], v[order]
+        start = 0
+        if t_start is not None:
+            side = "left" if include_start else "right"
+            start = np.searchsorted(t, t_start, side=side)
+        stop = t.size
+        if t_end is not None:
+            stop = np.searchsorted(t, t_end, side="right")
+        return t[start:stop], v[start:stop]
+
+    def logged_variables(self):
+        self.flush()
+        return self._names("log", ".f8")
+
+    def _boundary_values(self, last):
+        """
+        Returns the (timestamp, value) of the first or last sample of each
+        variable, in time order. Of several samples with the same timestamp,
+        the last appended one is the last value.
+        """
+        values = dict()
+        for name in self.logged_variables():
+            data = self._load_log(name)
+            if not data.shape[0]:
+                continue
+            t = data[:, 0]
+            i = t.size - 1 - np.argmax(t[::-1]) if last else np.argmin(t)
+            values[name] = (t[i].item(), data[i, 1].item())
+        return values
+
+    def first_values(self):
+        return self._boundary_values(last=False)
+
+    def last_values(self):
+        return self._boundary_values(last=True)
+
+    def add_datasets(self, datasets):
+        for ts, key, val in datasets:
+            index = self._scan_datasets(key)
+            f = self._dataset_files.get(key)
+            if f is None:
+                f = open(self._file_path("datasets", key, ".rec"), "ab")
+                self._dataset_files[key] = f
+            blob = _encode_dataset(val, self.dataset_compression.get(key))
+            offset = f.tell()
+            f.write(self._record.pack(ts, len(blob)))
+            f.write(blob)
+            index.append((ts, offset + self._record.size, len(blob)))
+
+    def _scan_datasets(self, name):
+        """
+        Returns the list of (timestamp, offset, length) of the records of
+        the datasets of name, which is built on first use.
+        """
+        index = self._dataset_index.get(name)
+        if index is not None:
+            return index
+        index = list()
+        path = self._file_path("datasets", name, ".rec")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                end = f.seek(0, os.SEEK_END)
+                pos = f.seek(0)
+                while pos + self._record.size <= end:
+                    ts, length = self._record.unpack(f.read(self._record.size))
+                    pos += self._record.size
+                    if pos + length > end:
+                        break
+                    index.append((ts, pos, length))
+                    pos = f.seek(pos + length)
+        self._dataset_index[name] = index
+        return index
+
+    def dataset_names(self):
+        self.flush()
+        return self._names("datasets", ".rec")
+
+    def dataset_times(self, name):
+        return [ts for ts, offset, length in self._scan_datasets(name)]
+
+    def read_dataset(self, name, ts):
+        for record_ts, offset, length in self._scan_datasets(name):
+            if record_ts == ts:
+                self.flush()
+                with open(self._file_path("datasets", name, ".rec"), "rb") as f:
+                    f.seek(offset)
+                    return _decode_dataset(f.read(length))
+        raise ValueError(f'No dataset "{name:}" at timestamp {ts:}')
+
+    def load_parameters(self):
+        return dict(self._parameters)
+
+    def parameter(self, name):
+        return self._parameters.get(name)
+
+    def save_parameters(self, params):
+        self._parameters.update(
+            (key, _decode_parameter(_encode_parameter(val)))
+            for key, val in params.items()
+        )
+        path = os.path.join(self.path, "parameters.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self._parameters, f)
+        os.replace(path + ".tmp", path)
+
+    def flush(self):
+        for f in list(self._log_files.values()) + list(self._dataset_files.values()):
+            f.flush()
+
+    def close(self):
+        self.flush()
+        for f in list(self._log_files.values()) + list(self._dataset_files.values()):
+            f.close()
+        self._log_files = dict()
+        self._dataset_files = dict()
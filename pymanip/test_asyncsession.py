@@ -0,0 +1,1109 @@
+import os
+import asyncio
+import sqlite3
+import time
+import pickle
+import struct
+import zlib
+import multiprocessing
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from aiohttp import web, ClientResponseError
+from aiohttp.test_utils import TestClient, TestServer
+
+from pymanip.asyncsession import (
+    AsyncSession,
+    AsyncRemoteObserver,
+    RemoteObserver,
+    _COLUMNS_MEDIA_TYPE,
+    _decode_columns,
+    _decode_columns_batch,
+    _pack_journal_datasets,
+)
+import pymanip.storage
+
+
+def _ingestion_worker(client, i):
+    client.add_entries("p", [float(i)], [float(i)])
+    client.add_dataset(img=np.full(2, i))
+
+
+def test_add_entry(tmpdir):
+    """
+
+    Test logging and reading back variables
+
+    """
+
+    with AsyncSession(os.path.join(tmpdir, "test_async"), verbose=False) as sesn:
+        for a in range(5):
+            sesn.add_entry(a=a, b=a ** 2)
+        sesn.save_parameter(c=3)
+
+    with AsyncSession(os.path.join(tmpdir, "test_async"), verbose=False) as sesn:
+        assert sesn.get_version() == AsyncSession.database_version
+        assert sesn.logged_variables() == {"a", "b"}
+        t, a = sesn["a"]
+        assert (a == (0, 1, 2, 3, 4)).all()
+        assert (t[1:] >= t[:-1]).all()
+        assert sesn.logged_last_values()["b"][1] == 16
+        assert sesn.parameter("c") == 3
+
+
+def test_upgrade_database(tmpdir):
+    """
+
+    Test the in-place migration of a version 1 database
+
+    """
+
+    filename = os.path.join(tmpdir, "old_session.db")
+    conn = sqlite3.connect(filename)
+    with conn as c:
+        c.execute("CREATE TABLE log_names (name TEXT);")
+        c.execute("CREATE TABLE log (timestamp INT, name TEXT, value REAL);")
+        c.execute("INSERT INTO log_names VALUES (?);", ("a",))
+        c.executemany(
+            "INSERT INTO log VALUES (?,?,?);", [(t, "a", 2 * t) for t in range(10)]
+        )
+    conn.close()
+
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sesn.get_version() == AsyncSession.database_version
+        t, v = sesn.logged_data_fromtimestamp("a", 4)
+        assert (t == (5, 6, 7, 8, 9)).all()
+        assert (v == 2 * t).all()
+        plan = sesn.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT timestamp, value FROM log "
+            "WHERE name=? AND timestamp > ?;",
+            ("a", 4),
+        ).fetchall()
+        assert "log_name_timestamp" in str(plan)
+        schema = "SELECT type, name FROM sqlite_master ORDER BY name;"
+        upgraded = sesn.conn.execute(schema).fetchall()
+
+    # new databases are created at the current version, with the same schema
+    with AsyncSession(os.path.join(tmpdir, "new_session"), verbose=False) as sesn:
+        assert sesn.get_version() == AsyncSession.database_version
+        assert sesn.conn.execute(schema).fetchall() == upgraded
+
+
+def test_write_behind(tmpdir):
+    """
+
+    Test that buffered entries are flushed by size, on read and on exit
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async.db")
+    with AsyncSession(
+        filename, verbose=False, write_behind=True, flush_size=10, flush_interval=3600
+    ) as sesn:
+        for a in range(5):
+            sesn.add_entry(a=a)
+        sesn.add_dataset(d=[1, 2, 3])
+        assert len(sesn._pending_entries) == 5
+        disk = sqlite3.connect(filename)
+        assert disk.execute("SELECT COUNT(*) FROM log;").fetchone()[0] == 0
+        for a in range(5, 9):
+            sesn.add_entry(a=a)
+        assert not sesn._pending_entries
+        assert disk.execute("SELECT COUNT(*) FROM log;").fetchone()[0] == 9
+        sesn.add_entry(a=9)
+        t, v = sesn.logged_data_fromtimestamp("a", 0)
+        assert v[-1] == 9
+        # queued entries are visible in the last values before the flush
+        sesn.add_group_entry("g", x=1.0)
+        sesn.add_entry(a=10)
+        last = sesn.logged_last_values()
+        assert last["a"][1] == 10 and last["x"][1] == 1.0
+        assert sesn._pending_entries and sesn._pending_groups
+        assert sesn.last_timestamp == last["a"][0]
+    assert disk.execute("SELECT COUNT(*) FROM log;").fetchone()[0] == 11
+    disk.close()
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sesn.dataset("d") == [1, 2, 3]
+
+
+def test_add_entries(tmpdir):
+    """
+
+    Test the bulk ingest API
+
+    """
+
+    t = 1e9 + np.arange(1000) / 100
+    with AsyncSession(os.path.join(tmpdir, "test_async"), verbose=False) as sesn:
+        sesn.add_entries("a", t, np.sin(t))
+        sesn.add_entries_multi(t, b=np.cos(t), c=2 * t)
+        with pytest.raises(ValueError):
+            sesn.add_entries("d", t, t[:10])
+        assert sesn.logged_variables() == {"a", "b", "c"}
+        tt, a = sesn["a"]
+        assert (tt == t).all()
+        assert (a == np.sin(t)).all()
+        tt, c = sesn["c"]
+        assert (c == 2 * t).all()
+
+
+def test_iter_logged_data(tmpdir):
+    """
+
+    Test the chunked reading of a logged variable
+
+    """
+
+    t = 1e9 + np.arange(1000.0)
+    with AsyncSession(os.path.join(tmpdir, "test_async"), verbose=False) as sesn:
+        sesn.add_entries("a", t, t ** 2)
+        chunks = list(sesn.iter_logged_data("a", chunk_size=300))
+        assert [tt.size for tt, vv in chunks] == [300, 300, 300, 100]
+        assert (np.hstack([tt for tt, vv in chunks]) == t).all()
+        chunks = list(sesn.iter_logged_data("a", chunk_size=300, timestamp=t[899]))
+        assert len(chunks) == 1
+        assert (chunks[0][1] == t[900:] ** 2).all()
+        sesn.add_entry(s="on")
+        sesn.add_entry(s="off")
+        ts, s = next(sesn.iter_logged_data("s"))
+        assert ts.dtype == np.float64 and s.tolist() == ["on", "off"]
+        assert sesn["s"][1].tolist() == ["on", "off"]
+
+
+def test_logged_first_last_values(tmpdir):
+    """
+
+    Test first and last values, and the in-memory last value table
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    t = 1e9 + np.arange(10.0)
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.add_entries_multi(t, a=t, b=-t)
+        sesn.add_entries("a", t - 100, t)
+        assert sesn.logged_first_values() == {
+            "a": (t[0] - 100, t[0]),
+            "b": (t[0], -t[0]),
+        }
+        assert sesn.logged_last_values() == {"a": (t[-1], t[-1]), "b": (t[-1], -t[-1])}
+        sesn.add_entry(b=np.float32(2))
+        ts, val = sesn.logged_last_values()["b"]
+        assert ts > t[-1] and val == 2 and type(val) is float
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sesn.logged_last_values()["b"] == (ts, 2.0)
+        assert sesn.last_timestamp == ts
+
+
+def test_dataset_storage(tmpdir):
+    """
+
+    Test the binary array format of datasets, with and without compression
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    arrays = {
+        "spectrum": np.linspace(0, 1, 1000),
+        "image": (np.arange(64 * 48) % 16).astype(np.uint16).reshape((64, 48)),
+        "times": np.arange(10).astype("datetime64[s]"),
+        "scalar": np.array(3.5),
+    }
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.set_dataset_compression("image", "zlib")
+        sesn.set_dataset_compression("spectrum", "lzma")
+        with pytest.raises(ValueError):
+            sesn.set_dataset_compression("spectrum", "rar")
+        sesn.add_dataset(**arrays)
+        sesn.add_dataset(raw=arrays["image"].T, other={"a": 1})
+    with AsyncSession(filename, verbose=False) as sesn:
+        for name, arr in arrays.items():
+            data = sesn.dataset(name)
+            assert data.dtype == arr.dtype
+            assert (data == arr).all()
+        raw = sesn.dataset("raw")
+        assert not raw.flags.writeable
+        assert (raw == arrays["image"].T).all()
+        assert sesn.dataset("other") == {"a": 1}
+        size = sesn.conn.execute(
+            "SELECT length(data) FROM dataset WHERE name=?;", ("image",)
+        ).fetchone()[0]
+        assert size < arrays["image"].nbytes / 2
+
+
+def test_dataset_chunks(tmpdir):
+    """
+
+    Test chunked storage of large datasets and dataset_slice
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    stack = np.arange(100 * 30, dtype=np.float64).reshape((100, 30))
+    with AsyncSession(filename, verbose=False, write_behind=True) as sesn:
+        sesn.backend.dataset_chunk_size = 1000
+        sesn.set_dataset_compression("compressed", "zlib")
+        sesn.add_dataset(stack=stack, small=stack[:2], compressed=stack[:3])
+        sesn.add_dataset(lst=[1, 2, 3])
+        assert sesn.conn.execute("SELECT COUNT(*) FROM dataset_chunks;").fetchone()[
+            0
+        ] == (100 // 4)
+    with AsyncSession(filename, verbose=False) as sesn:
+        ts = sesn.dataset_times("stack")[0]
+        assert (sesn.dataset("stack", ts) == stack).all()
+        assert (sesn.dataset("stack") == stack).all()
+        for start, stop in [(0, 1), (3, 9), (10, 90), (-5, None), (50, 10)]:
+            assert (
+                sesn.dataset_slice("stack", ts, start, stop) == stack[start:stop]
+            ).all()
+        assert (sesn.dataset_slice("small", ts, 1) == stack[1:2]).all()
+        assert (sesn.dataset_slice("compressed", ts, 1, 2) == stack[1:2]).all()
+        ts_lst = sesn.dataset_times("lst")[0]
+        assert sesn.dataset_slice("lst", ts_lst, 1) == [2, 3]
+        with pytest.raises(ValueError):
+            sesn.dataset_slice("stack", ts + 1)
+
+
+def test_logged_data_range(tmpdir):
+    """
+
+    Test time-range queries and decimation
+
+    """
+
+    t = 1e9 + np.arange(10000.0)
+    v = np.sin(t / 100)
+    v[5000] = 10
+    with AsyncSession(os.path.join(tmpdir, "test_async"), verbose=False) as sesn:
+        sesn.add_entries("a", t, v)
+        tt, vv = sesn.logged_data_range("a", t[10], t[20])
+        assert (tt == t[10:21]).all()
+        assert (vv == v[10:21]).all()
+        tt, vv = sesn.logged_data_range("a", t_start=t[-5])
+        assert (tt == t[-5:]).all()
+        for method in ("minmax", "lttb"):
+            tt, vv = sesn.logged_data_range("a", max_points=500, method=method)
+            assert 0 < tt.size <= 500
+            assert (np.diff(tt) > 0).all()
+            assert vv.max() == 10
+            assert np.isin(tt, t).all()
+        tt, vv = sesn.logged_data_range("a", max_points=500)
+        assert vv.min() == v.min()
+        for method in ("minmax", "lttb"):
+            assert sesn.logged_data_range("a", max_points=1, method=method)[0].size == 1
+        with pytest.raises(ValueError):
+            sesn.logged_data_range("a", max_points=500, method="average")
+        # text values are not decimated
+        sesn.add_entries_multi(t[:10], b=np.arange(10.0))
+        sesn.add_entry(b="on", st="off")
+        sesn.add_entry(st="on")
+        assert sesn.logged_data_range("b", max_points=4)[0].size == 11
+        data = sesn.logged_data_batch(max_points=1)
+        assert data["st"][1].tolist() == ["off", "on"]
+        # the buckets are selected by the database, without reading the range
+        sesn.backend.read_log = None
+        tt, vv = sesn.logged_data_range("a", t[100], t[-100], max_points=100)
+        assert tt.size == 100 and vv.max() == 10
+
+
+def test_aggregates(tmpdir, monkeypatch):
+    """
+
+    Test the aggregate buckets and their use for decimated range queries
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    t = 3600 * 277777 + np.arange(0, 7200, 0.5)
+    v = np.sin(2 * np.pi * t / 600)
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.add_entries("a", t[:1000], v[:1000])
+        sesn.enable_aggregates((1, 60, 3600))
+        sesn.add_entries("a", t[1000:], v[1000:])
+        sesn.add_entry(b="text")
+    with AsyncSession(filename, verbose=False) as sesn:
+        tt, n, vmin, vmax, vmean = sesn.logged_data_aggregate("a", 60)
+        assert n.sum() == t.size
+        assert (n == 120).all()
+        assert np.allclose(vmean, v.reshape((-1, 120)).mean(axis=1))
+        assert (vmax == v.reshape((-1, 120)).max(axis=1)).all()
+        tt, n, vmin, vmax, vmean = sesn.logged_data_aggregate("a", 3600, t[0], t[0])
+        assert tt.size == 1 and vmin[0] == v[:7200].min()
+        tt, vv = sesn.logged_data_range("a", max_points=500)
+        assert tt.size == 240
+        assert vv.max() == v.max() and vv.min() == v.min()
+        tt, vv = sesn.logged_data_range("a", max_points=500, method="lttb")
+        assert tt.size == 120
+        tt, vv = sesn.logged_data_range("a", t[10], t[100], max_points=500)
+        assert (tt == t[10:101]).all()
+        with pytest.raises(ValueError):
+            sesn.logged_data_aggregate("a", 10)
+
+    # the aggregates require a newer SQLite than the rest of the session
+    monkeypatch.setattr(pymanip.storage, "_AGGREGATE_SQLITE_VERSION", (99, 0, 0))
+    with pytest.raises(RuntimeError):
+        AsyncSession(filename, verbose=False)
+    with AsyncSession(os.path.join(tmpdir, "test_old"), verbose=False) as sesn:
+        sesn.save_parameter(a=1)
+        sesn.save_parameter(a=2)
+        assert sesn.parameter("a") == 2
+        with pytest.raises(RuntimeError):
+            sesn.enable_aggregates((1,))
+
+
+def test_compact(tmpdir):
+    """
+
+    Test the compaction of old log values and datasets
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    now = time.time()
+    t = now - 7199.5 + np.arange(7200.0)
+    tb = (now - 7000) // 60 * 60 + np.arange(10.0)
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.enable_aggregates((3600,))
+        sesn.add_entries("a", t, t)
+        sesn.add_entries("b", tb, tb)
+        for i in range(5):
+            sesn.add_dataset(d=np.arange(i + 1))
+        sesn.compact(max_age=3600, bucket=60, keep_datasets=2)
+        cutoff = sesn.parameter("_compacted_until")
+        assert cutoff % 60 == 0 and now - 3660 < cutoff <= now - 3600
+        tt, vv = sesn["a"]
+        old = tt < cutoff
+        assert 59 <= old.sum() <= 61
+        assert np.allclose(tt, vv)
+        assert (tt[~old] == t[t >= cutoff]).all()
+        # the buckets which are already compacted are left unchanged
+        sesn.compact(max_age=3600, bucket=60)
+        assert (sesn["a"][0][: old.sum()] == tt[old]).all()
+        assert sesn["b"][0].size == 1
+        assert np.allclose(sesn.logged_last_values()["b"], tb.mean())
+        assert sesn.logged_data_aggregate("a", 3600)[1].sum() == 7200
+        assert len(sesn.dataset_times("d")) == 2
+        assert (sesn.dataset("d", sesn.dataset_times("d")[0]) == np.arange(4)).all()
+
+    # the values packed in log blocks are compacted likewise
+    with AsyncSession(os.path.join(tmpdir, "test_blocks"), verbose=False) as sesn:
+        sesn.enable_log_blocks(1000)
+        sesn.add_entries("a", t, t)
+        sesn.compact(max_age=3600, bucket=60)
+        cutoff = sesn.parameter("_compacted_until")
+        tt, vv = sesn["a"]
+        old = tt < cutoff
+        assert 59 <= old.sum() <= 61
+        assert np.allclose(tt, vv)
+        assert (tt[~old] == t[t >= cutoff]).all()
+        sesn.compact(max_age=3600, bucket=60)
+        assert (sesn["a"][0] == tt).all()
+        # the new blocks do not overlap
+        blocks = sesn.conn.execute(
+            "SELECT t_first, t_last FROM log_blocks ORDER BY t_first;"
+        ).fetchall()
+        assert all(b[0] > a[1] for a, b in zip(blocks, blocks[1:]))
+
+
+def test_run_reader(tmpdir):
+    """
+
+    Test reads in the reader threads while entries are being added
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+
+    async def read_while_writing(sesn):
+        sesn.add_entries("a", np.arange(100.0), np.arange(100.0))
+        t, v = await sesn.run_reader(sesn.logged_data_fromtimestamp, "a", 49)
+        assert (t == np.arange(50.0, 100.0)).all()
+        sesn.add_entry(a=100)
+        t, v = await sesn.run_reader(sesn.__getitem__, "a")
+        assert v[-1] == 100
+        assert (await sesn.run_reader(sesn.parameters))["_database_version"] >= 6
+
+    with AsyncSession(filename, verbose=False, write_behind=True) as sesn:
+        sesn.start_readers()
+        assert sesn.backend.reader_pool is not None
+        mode = sesn.conn.execute("PRAGMA journal_mode;").fetchone()[0]
+        assert mode == "wal"
+        asyncio.run(read_while_writing(sesn))
+        assert sesn.backend._reader_conns
+        sesn.stop_readers()
+        mode = sesn.conn.execute("PRAGMA journal_mode;").fetchone()[0]
+        assert mode == "delete"
+
+    with AsyncSession(verbose=False) as sesn:
+        sesn.start_readers()
+        assert sesn.backend.reader_pool is None
+        asyncio.run(read_while_writing(sesn))
+
+
+def test_delay_save(tmpdir):
+    """
+
+    Test the in-memory delay_save mode and its periodic checkpoints
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async.db")
+
+    def saved_count():
+        disk = sqlite3.connect(filename)
+        try:
+            return disk.execute("SELECT COUNT(*) FROM log;").fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0
+        finally:
+            disk.close()
+
+    async def acquisition(sesn):
+        sesn.add_entries("a", np.arange(100.0), np.arange(100.0))
+        await asyncio.sleep(1.0)
+        assert saved_count() == 101
+        sesn.running = False
+
+    async def run_checkpoints(sesn):
+        await asyncio.gather(sesn.checkpoint_task(), acquisition(sesn))
+
+    with AsyncSession(
+        filename, verbose=False, delay_save=True, checkpoint_interval=0.5
+    ) as sesn:
+        sesn.add_entry(a=100)
+        assert saved_count() == 0
+        sesn.running = True
+        asyncio.run(run_checkpoints(sesn))
+    assert saved_count() == 101
+
+    with AsyncSession(filename, verbose=False, delay_save=True) as sesn:
+        assert sesn["a"][0].size == 101
+        sesn.add_entry(a=101)
+    assert saved_count() == 102
+
+
+def test_memory_budget(tmpdir):
+    """
+
+    Test spilling of delay_save sessions with a memory_budget
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async.db")
+    stack = np.arange(100 * 30, dtype=np.float64).reshape((100, 30))
+    with AsyncSession(
+        filename, verbose=False, delay_save=True, memory_budget=200000
+    ) as sesn:
+        sesn.backend.dataset_chunk_size = 1000
+        sesn.enable_aggregates([10.0])
+        sesn.add_dataset(stack=stack)
+        for i in range(10):
+            sesn.add_entries(
+                "a", np.arange(i * 1000.0, (i + 1) * 1000.0), np.ones(1000)
+            )
+            assert sesn.memory_usage() < 400000
+        spilled = sesn.conn.execute("SELECT COUNT(*) FROM disk.log;").fetchone()[0]
+        assert 0 < spilled < 10000
+        t, v = sesn["a"]
+        assert (t == np.arange(10000.0)).all()
+        assert sesn.logged_first_values()["a"] == (0.0, 1.0)
+        assert sesn.logged_last_values()["a"] == (9999.0, 1.0)
+        bucket_t, n, vmin, vmax, vmean = sesn.logged_data_aggregate("a", 10.0)
+        assert bucket_t.size == 1000
+        assert (n == 10).all()
+        ts = sesn.dataset_times("stack")[0]
+        assert (sesn.dataset_slice("stack", ts, 10, 90) == stack[10:90]).all()
+        sesn.save_parameter(b=2)
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sesn["a"][0].size == 10000
+        assert sesn.parameter("b") == 2
+        assert (sesn.dataset("stack") == stack).all()
+
+    async def acquisition(sesn):
+        now = time.time()
+        sesn.add_entries("c", now - 3600 + np.arange(10000.0) / 10, np.ones(10000))
+        sesn.add_entries("c", now + np.arange(5.0), np.ones(5))
+        # the writes do not spill while the spill task runs
+        assert sesn.backend._memory_used() > sesn.memory_budget
+        await asyncio.sleep(0.5)
+        assert sesn.backend._memory_used() <= sesn.memory_budget
+        # only old rows are spilled
+        assert sesn.conn.execute(
+            "SELECT COUNT(*) FROM main.log WHERE timestamp >= ?;", (now,)
+        ).fetchone() == (5,)
+        sesn.running = False
+
+    async def run_spills(sesn):
+        await asyncio.gather(sesn.spill_task(), acquisition(sesn))
+
+    with AsyncSession(
+        filename, verbose=False, delay_save=True, memory_budget=200000
+    ) as sesn:
+        sesn.add_entry(a=2.0)
+        assert sesn.memory_usage() < 100000
+        assert sesn["a"][0].size == 10001
+        sesn.running = True
+        sesn.spill_interval = 0.1
+        asyncio.run(run_spills(sesn))
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sesn["a"][0].size == 10001
+        assert sesn["c"][0].size == 10005
+
+
+def test_parameters(tmpdir):
+    """
+
+    Test the parameter cache, upserts and non-REAL parameters
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async.db")
+    conn = sqlite3.connect(filename)
+    with conn as c:
+        c.execute("CREATE TABLE parameters (name TEXT, value REAL);")
+        c.executemany(
+            "INSERT INTO parameters VALUES (?,?);",
+            [("_database_version", 3), ("a", 1), ("a", 2)],
+        )
+    conn.close()
+
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sesn.parameter("a") == 2
+        sesn.save_parameter(a=3, b="12", c=[1, 2.5], d={"x": "y"}, e=np.float32(0.5))
+        sesn.save_parameter(a=4)
+        assert not sesn.has_parameter("f")
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sesn.conn.execute(
+            "SELECT COUNT(*) FROM parameters WHERE name=?;", ("a",)
+        ).fetchone() == (1,)
+        assert sesn.parameters()["a"] == 4
+        assert sesn.parameter("b") == "12"
+        assert sesn.parameter("c") == [1, 2.5]
+        assert sesn.parameter("d") == {"x": "y"}
+        assert sesn.parameter("e") == 0.5
+        assert sesn.has_parameter("d")
+        # the lookups do not copy the parameters
+        sesn.backend.load_parameters = None
+        assert sesn.parameter("a") == 4
+        assert sesn.has_parameter("b")
+
+
+def test_group_entries(tmpdir):
+    """
+
+    Test grouped logging of synchronous variables in a wide table
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    t = np.arange(100.0)
+    with AsyncSession(filename, verbose=False, write_behind=True) as sesn:
+        sesn.enable_aggregates([10.0])
+        sesn.add_group_entries("temperatures", t, T1=t, T2=2 * t)
+        sesn.add_group_entry("temperatures", T1=1.0, T2=2.0, T3=3.0)
+        sesn.add_entry(p=1.0)
+        with pytest.raises(ValueError):
+            sesn.add_entry(T1=1.0)
+        with pytest.raises(ValueError):
+            sesn.add_group_entry("pressures", p=1.0)
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sesn.logged_variables() == {"T1", "T2", "T3", "p"}
+        assert sesn.conn.execute(
+            "SELECT COUNT(*) FROM log_group_temperatures;"
+        ).fetchone() == (101,)
+        assert sesn.conn.execute("SELECT COUNT(*) FROM log;").fetchone() == (1,)
+        t2, v2 = sesn["T2"]
+        assert (t2[:100] == t).all()
+        assert (v2 == np.hstack((2 * t, 2.0))).all()
+        assert sesn["T3"][1].tolist() == [3.0]
+        assert sesn.logged_first_values()["T3"][1] == 3.0
+        assert sesn.logged_last_values()["T1"][1] == 1.0
+        tf, vf = sesn.logged_data_fromtimestamp("T1", 95.0)
+        assert vf.tolist() == [96.0, 97.0, 98.0, 99.0, 1.0]
+        tr, vr = sesn.logged_data_range("T2", 10.0, 19.0)
+        assert (vr == 2 * t[10:20]).all()
+        bucket_t, n, vmin, vmax, vmean = sesn.logged_data_aggregate("T2", 10.0, 0, 99)
+        assert (n == 10).all()
+        assert (vmax == 2 * t[9::10]).all()
+        sesn.compact(max_age=0, bucket=50.0)
+        assert (sesn["T1"][1][:2] == (24.5, 74.5)).all()
+
+
+def test_log_blocks(tmpdir):
+    """
+
+    Test the packing of logged values in compressed blocks
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    t = 1.6e9 + np.arange(1000) * 0.1
+    v = np.sin(np.arange(1000) / 10)
+    v[500] = np.nan
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.add_entries("a", t[:300], v[:300])
+        sesn.enable_log_blocks(128)
+        assert sesn.conn.execute("SELECT COUNT(*) FROM log;").fetchone() == (44,)
+        sesn.add_entries("a", t[300:], v[300:])
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sesn.conn.execute("SELECT SUM(n) FROM log_blocks;").fetchone() == (896,)
+        ta, va = sesn["a"]
+        assert (ta == t).all()
+        assert np.array_equal(va, v, equal_nan=True)
+        tr, vr = sesn.logged_data_range("a", t[100], t[899])
+        assert (tr == np.delete(t[100:900], 400)).all()
+        tf, vf = sesn.logged_data_fromtimestamp("a", t[990])
+        assert (vf == v[991:]).all()
+        assert sesn.logged_first_values()["a"] == (t[0], v[0])
+        assert sesn.logged_last_values()["a"] == (t[-1], v[-1])
+        assert sesn._tail_start("a", 200) == t[-200]
+        chunks = list(sesn.iter_logged_data("a", chunk_size=100, timestamp=t[10]))
+        assert (np.concatenate([c[0] for c in chunks]) == t[11:]).all()
+        # the aggregates of a new level include the values packed in blocks
+        sesn.enable_aggregates([10.0])
+        tt, n, vmin, vmax, vmean = sesn.logged_data_aggregate("a", 10.0)
+        assert n.sum() == 999
+        assert vmax.max() == np.nanmax(v)
+
+
+def test_journal(tmpdir):
+    """
+
+    Test the replay of the journal after a crash
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+
+    def crash(sesn):
+        sesn.conn.close()
+        sesn._journal.close()
+
+    sesn = AsyncSession(filename, verbose=False, journal=True, flush_size=10 ** 6)
+    sesn.add_entries("a", np.arange(10.0), np.arange(10.0))
+    sesn.add_dataset(img=np.ones(3))
+    sesn.flush()
+    sesn.add_entry(a=10.0)
+    with open(filename + ".journal", "rb") as f:
+        journal = f.read()
+    sesn.flush()
+    # the journal was not emptied after the last flush
+    with open(filename + ".journal", "wb") as f:
+        f.write(journal + b"\x00\x01")
+    crash(sesn)
+
+    sesn = AsyncSession(filename, verbose=False, journal=True, flush_size=10 ** 6)
+    assert sesn["a"][1].tolist() == list(range(11))
+    sesn.add_entry(a=11.0, state="on", b=None)
+    sesn.add_group_entries("g", [1.0, 2.0], x=[3.0, np.nan], y=[5.0, 6.0])
+    sesn.add_dataset(img=np.zeros(3), lst=[1, "a"])
+    crash(sesn)
+
+    with AsyncSession(filename, verbose=False, journal=True) as sesn:
+        assert sesn["a"][1].tolist() == list(range(12))
+        assert sesn.logged_last_values()["state"][1] == "on"
+        assert sesn.logged_last_values()["y"] == (2.0, 6.0)
+        assert sesn.logged_data_range("x")[1].tolist() == [3.0]
+        times = sesn.dataset_times("img")
+        assert len(times) == 2
+        assert (sesn.dataset("img", times[-1]) == 0).all()
+        assert sesn.dataset("lst") == [1, "a"]
+    assert not os.path.exists(filename + ".journal")
+
+    # a dataset record which is not an array is not unpickled
+    sesn = AsyncSession(filename, verbose=False, journal=True, flush_size=10 ** 6)
+    sesn.add_entry(a=12.0)
+    crash(sesn)
+    payload = _pack_journal_datasets([(1.0, "evil", pickle.dumps([1]))])
+    with open(filename + ".journal", "ab") as f:
+        f.write(b"D" + struct.pack("<II", len(payload), zlib.crc32(payload)))
+        f.write(payload)
+    with AsyncSession(filename, verbose=False, journal=True) as sesn:
+        assert sesn["a"][1].tolist() == list(range(13))
+        assert "evil" not in sesn.dataset_names()
+
+
+def test_ingestion(tmpdir):
+    """
+
+    Test the ingestion of entries from threads and processes
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    with AsyncSession(filename, verbose=False) as sesn:
+        client = sesn.ingestion_client()
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda i: client.add_entries("a", [i], [i]), range(20)))
+        # the entries are queued until the thread of the session writes them
+        assert sesn.ingest() == 20
+        assert sesn.ingest() == 0
+        assert sesn["a"][1].tolist() == list(range(20))
+
+        client = sesn.ingestion_client()
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda i: client.add_entry(b=i), range(20)))
+        client.add_group_entry("g", x=1.0, y=2.0)
+        client.save_parameter(c=3)
+        # the arrays are queued as they were when they were logged
+        buf = np.zeros(3)
+        with ThreadPoolExecutor(1) as pool:
+            pool.submit(client.add_dataset, buf=buf).result()
+        buf[0] = 99.0
+
+        client = sesn.ingestion_client(processes=True)
+        workers = [
+            multiprocessing.Process(target=_ingestion_worker, args=(client, i))
+            for i in range(3)
+        ]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sorted(sesn["b"][1].tolist()) == list(range(20))
+        assert sesn["x"][1].tolist() == [1.0]
+        assert sesn.parameter("c") == 3
+        assert sesn["p"][1].tolist() == [0.0, 1.0, 2.0]
+        assert len(sesn.dataset_times("img")) == 3
+        assert sesn.dataset("buf").tolist() == [0.0, 0.0, 0.0]
+
+    # a delay_save session built in a worker thread, and used and closed
+    # by the main thread
+    filename = os.path.join(tmpdir, "test_threads")
+    with ThreadPoolExecutor(1) as pool:
+        sesn = pool.submit(AsyncSession, filename, False, True).result()
+        client = sesn.ingestion_client()
+        pool.submit(client.add_entry, c=1.0).result()
+    with sesn:
+        sesn.add_entry(b=2.0)
+    with AsyncSession(filename, verbose=False) as sesn:
+        assert sesn["b"][1].tolist() == [2.0]
+        assert sesn["c"][1].tolist() == [1.0]
+
+
+def test_recent_samples(tmpdir):
+    """
+
+    Test the ring buffers of recent samples
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.add_entries("a", np.arange(10.0), np.arange(10.0))
+    with AsyncSession(filename, verbose=False, write_behind=True) as sesn:
+        sesn.recent_size = 8
+        sesn.add_entries("a", np.arange(10.0, 15.0), np.arange(10.0, 15.0))
+        sesn.add_entries("a", [12.5], [np.nan])
+        sesn.add_group_entry("g", x=1.0)
+        sesn.add_entry(s="text")
+        # served from the buffer, without flushing
+        t, v = sesn.logged_data_fromtimestamp("a", 9.0)
+        assert t.tolist() == [10.0, 11.0, 12.0, 13.0, 14.0]
+        assert sesn._pending_entries
+        assert sesn._recent_data("a", 8.0) is None
+        assert sesn.logged_data_fromtimestamp("a", 8.0)[1].tolist() == list(
+            range(9, 15)
+        )
+        assert sesn._recent_data("x", 0.0)[1].tolist() == [1.0]
+        assert sesn._recent_data("s", 0.0) is None
+        sesn.add_entries("a", np.arange(15.0, 20.0), np.arange(15.0, 20.0))
+        assert sesn._recent_data("a", 11.0) is None
+        t, v = sesn._recent_data("a", 12.0)
+        assert v.tolist() == list(range(13, 20))
+        assert v.tolist() == sesn.logged_data_fromtimestamp("a", 12.0)[1].tolist()
+        for i in range(20, 25):
+            sesn.add_entries("a", [float(i)], [float(i)])
+        assert sesn._recent_data("a", 15.0) is None
+        assert sesn._recent_data("a", 16.0)[1].tolist() == list(range(17, 25))
+
+
+def test_stream(tmpdir):
+    """
+
+    Test the push of new entries to the clients of the web server
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+
+    async def client_session(sesn):
+        async with TestClient(TestServer(sesn.web_application())) as client:
+            ws = await client.ws_connect("/api/stream")
+            await ws.send_json({})
+            assert await ws.receive_json() == {"a": [[2.0, 2.0]]}
+            ws_a = await client.ws_connect("/api/stream")
+            await ws_a.send_json({"names": ["a"], "last_ts": 0.0})
+            assert await ws_a.receive_json() == {"a": [[1.0, 1.0], [2.0, 2.0]]}
+            sesn.add_entries("a", [3.0, 4.0], [3.0, 4.0])
+            sesn.add_entry(b="text")
+            assert await ws_a.receive_json() == {"a": [[3.0, 3.0], [4.0, 4.0]]}
+            data = await ws.receive_json()
+            assert data["a"] == [[3.0, 3.0], [4.0, 4.0]]
+            assert data["b"][0][1] == "text"
+            await ws.close()
+            await ws_a.close()
+        await asyncio.sleep(0.1)
+        assert not sesn._subscribers
+
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.add_entries("a", [1.0, 2.0], [1.0, 2.0])
+        sesn.running = True
+        asyncio.run(client_session(sesn))
+
+
+def test_coalesced_queries(tmpdir):
+    """
+
+    Test that concurrent queries of the web server share their result
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.add_entries("a", np.arange(10.0), np.arange(10.0))
+        queries = list()
+        query = sesn.logged_data_fromtimestamp
+
+        def logged_data_fromtimestamp(name, timestamp):
+            queries.append(timestamp)
+            return query(name, timestamp)
+
+        sesn.logged_data_fromtimestamp = logged_data_fromtimestamp
+
+        async def fetch(*timestamps):
+            return await asyncio.gather(
+                *[sesn.coalesced_data_fromtimestamp("a", ts) for ts in timestamps]
+            )
+
+        results = asyncio.run(fetch(5.0, 5.5, 5.0, 3.0))
+        assert queries == [5.0, 3.0]
+        assert [v.tolist() for t, v in results] == [
+            [6.0, 7.0, 8.0, 9.0],
+            [6.0, 7.0, 8.0, 9.0],
+            [6.0, 7.0, 8.0, 9.0],
+            [4.0, 5.0, 6.0, 7.0, 8.0, 9.0],
+        ]
+        asyncio.run(fetch(5.0))
+        assert queries == [5.0, 3.0]
+        sesn.add_entry(a=10.0)
+        assert asyncio.run(fetch(9.0))[0][1].tolist() == [10.0]
+        assert queries == [5.0, 3.0, 9.0]
+
+
+def test_columns_transport(tmpdir):
+    """
+
+    Test the binary columns format and the compression of the web API
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+
+    async def client_session(sesn):
+        async with TestClient(TestServer(sesn.web_application())) as client:
+            params = {"name": "a", "last_ts": 0.5}
+            r = await client.post("/api/data_from_ts", json=params)
+            assert r.headers["Content-Encoding"] in ("gzip", "deflate")
+            assert await r.json() == [[float(i), float(i)] for i in range(1, 500)]
+            r = await client.post(
+                "/api/data_from_ts",
+                json=params,
+                headers={"Accept": _COLUMNS_MEDIA_TYPE},
+            )
+            assert r.headers["Content-Type"] == _COLUMNS_MEDIA_TYPE
+            t, v = _decode_columns(await r.read())
+            assert t.tolist() == v.tolist() == list(range(1, 500))
+            r = await client.post(
+                "/api/data_range",
+                json={"name": "a", "max_points": 10},
+                headers={"Accept": _COLUMNS_MEDIA_TYPE},
+            )
+            t, v = _decode_columns(await r.read())
+            assert 0 < t.size <= 10
+
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.add_entries("a", np.arange(500.0), np.arange(500.0))
+        asyncio.run(client_session(sesn))
+
+
+def test_data_batch(tmpdir):
+    """
+
+    Test the batch endpoint of the web API
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+
+    async def client_session(sesn):
+        async with TestClient(TestServer(sesn.web_application())) as client:
+            r = await client.post("/api/data_batch", json={"t_start": 1.0})
+            assert await r.json() == {
+                "a": [[1.0, 10.0], [2.0, 20.0]],
+                "b": [[2.0, 2.0], [3.0, 3.0]],
+            }
+            r = await client.post(
+                "/api/data_batch",
+                json={"names": ["a", "b"], "t_end": 2.5, "align": True},
+            )
+            assert await r.json() == {
+                "time": [0.0, 1.0, 2.0],
+                "values": {"a": [0.0, 10.0, 20.0], "b": [None, None, 2.0]},
+            }
+            r = await client.post(
+                "/api/data_batch", json={"names": ["a"], "max_points": 2}
+            )
+            assert len((await r.json())["a"]) <= 2
+            r = await client.post(
+                "/api/data_batch", json={"since": {"a": 1.0, "b": 2.0}}
+            )
+            assert await r.json() == {"a": [[2.0, 20.0]], "b": [[3.0, 3.0]]}
+            r = await client.post(
+                "/api/data_batch",
+                json={"since": {"a": 1.0, "b": 2.0}},
+                headers={"Accept": _COLUMNS_MEDIA_TYPE},
+            )
+            assert r.content_type == _COLUMNS_MEDIA_TYPE
+            data = _decode_columns_batch(await r.read())
+            assert data["a"][1].tolist() == [20.0] and data["b"][0].tolist() == [3.0]
+            # text values are sent as JSON
+            sesn.add_entry(st="on")
+            r = await client.post(
+                "/api/data_batch",
+                json={"since": {"a": 1.0, "st": 0.0}},
+                headers={"Accept": _COLUMNS_MEDIA_TYPE},
+            )
+            assert (await r.json())["st"][0][1] == "on"
+
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.add_entries("a", [0.0, 1.0, 2.0], [0.0, 10.0, 20.0])
+        sesn.add_entries("b", [2.0, 3.0], [2.0, 3.0])
+        asyncio.run(client_session(sesn))
+
+
+def test_async_remote_observer(tmpdir):
+    """
+
+    Test the incremental recording of AsyncRemoteObserver
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+
+    async def record(sesn):
+        async with TestServer(sesn.web_application()) as server:
+            async with AsyncRemoteObserver(server.host, server.port) as obs:
+                await obs.start_recording(interval=0.05)
+                first = obs._poller
+                await obs.start_recording(interval=0.05)
+                assert first.done()
+                for i in range(5):
+                    sesn.add_entry(a=i, b=-i)
+                    await asyncio.sleep(0.05)
+                sesn.add_entry(a=5, b=-5)
+                data = await obs.stop_recording()
+        assert data["a"] == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+        assert data["b"] == [-v for v in data["a"]]
+        assert len(data["time"]) == 6
+        assert data["c"] == 3
+
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.add_entry(a=-1, b=1)
+        sesn.save_parameter(c=3)
+        time.sleep(0.01)
+        asyncio.run(record(sesn))
+
+
+def test_remote_observer(tmpdir):
+    """
+
+    Test the incremental recording of RemoteObserver, with the session and
+    its web server in another thread
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    started = queue.Queue()
+    stop = threading.Event()
+
+    def serve():
+        async def add_entry(**kwargs):
+            sesn.add_entry(**kwargs)
+
+        async def server_loop():
+            async with TestServer(sesn.web_application()) as server:
+                loop = asyncio.get_running_loop()
+                started.put((server.host, server.port, loop, add_entry))
+                while not stop.is_set():
+                    await asyncio.sleep(0.01)
+
+        with AsyncSession(filename, verbose=False) as sesn:
+            sesn.add_entry(a=-1, b=1)
+            sesn.save_parameter(c=3)
+            time.sleep(0.01)
+            asyncio.run(server_loop())
+
+    server = threading.Thread(target=serve)
+    server.start()
+    try:
+        host, port, loop, add_entry = started.get(timeout=10)
+        with RemoteObserver(host, port) as obs:
+            obs.start_recording(interval=0.05)
+            first = obs._poller
+            # a new recording stops the poller of the previous one
+            obs.start_recording(interval=0.05)
+            assert not first.is_alive()
+            for i in range(6):
+                asyncio.run_coroutine_threadsafe(add_entry(a=i, b=-i), loop).result()
+                time.sleep(0.05)
+            data = obs.stop_recording()
+            assert obs._poller is None
+    finally:
+        stop.set()
+        server.join()
+    assert data["a"] == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+    assert data["b"] == [-v for v in data["a"]]
+    assert len(data["time"]) == 6
+    assert data["c"] == 3
+
+
+def test_remote_observer_status(tmpdir):
+    """
+
+    Test the fallback of AsyncRemoteObserver to one request per variable
+    when the server has no batch endpoint, and the errors of the server
+
+    """
+
+    filename = os.path.join(tmpdir, "test_async")
+    status = [404]
+
+    @web.middleware
+    async def batch_status(request, handler):
+        if request.path == "/api/data_batch":
+            return web.json_response({"error": "unavailable"}, status=status[0])
+        return await handler(request)
+
+    async def record(sesn):
+        app = sesn.web_application()
+        app.middlewares.append(batch_status)
+        async with TestServer(app) as server:
+            async with AsyncRemoteObserver(server.host, server.port) as obs:
+                await obs.start_recording()
+                sesn.add_entry(a=1.0)
+                data = await obs.stop_recording(reduce_time=False)
+                assert data["a"]["value"] == [1.0]
+                status[0] = 500
+                await obs.start_recording()
+                with pytest.raises(ClientResponseError):
+                    await obs.stop_recording()
+
+    with AsyncSession(filename, verbose=False) as sesn:
+        sesn.add_entry(a=0.0)
+        time.sleep(0.01)
+        asyncio.run(record(sesn))
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pytest
+
+from pymanip.asyncsession import AsyncSession
+from pymanip.storage import SQLiteBackend, BinaryBackend
+
+
+@pytest.mark.parametrize("backend_class", [SQLiteBackend, BinaryBackend])
+def test_backend(tmpdir, backend_class):
+    """
+
+    Test the storage backend interface
+
+    """
+
+    path = os.path.join(tmpdir, "test_storage")
+    t = np.arange(10.0)
+    backend = backend_class(path)
+    backend.add_entries(list(zip(t, ["a"] * 10, t ** 2)))
+    backend.add_entries([(0.5, "b", 1.0), (1.5, "b", None)])
+    backend.add_datasets([(1.0, "img", np.ones((2, 3))), (2.0, "img", [1, 2])])
+    backend.save_parameters({"c": 3, "d": "text"})
+    backend.close()
+
+    backend = backend_class(path)
+    assert {"a", "b"} <= set(backend.logged_variables())
+    ta, va = backend.read_log("a")
+    assert (ta == t).all() and (va == t ** 2).all()
+    ta, va = backend.read_log("a", 2.0, 5.0, include_start=False)
+    assert ta.tolist() == [3.0, 4.0, 5.0]
+    assert np.isnan(backend.read_log("b")[1][1])
+    assert backend.first_values()["a"] == (0.0, 0.0)
+    assert backend.last_values()["a"] == (9.0, 81.0)
+    assert backend.dataset_names() == {"img"}
+    assert list(backend.dataset_times("img")) == [1.0, 2.0]
+    assert (backend.read_dataset("img", 1.0) == 1).all()
+    assert backend.read_dataset("img", 2.0) == [1, 2]
+    params = backend.load_parameters()
+    assert params["c"] == 3 and params["d"] == "text"
+    backend.close()
+
+
+def test_binary_session(tmpdir):
+    """
+
+    Test AsyncSession stored by BinaryBackend, with the generic aggregates,
+    groups and dataset compression, and recovery of a truncated log file
+
+    """
+
+    path = os.path.join(tmpdir, "test_storage")
+    with AsyncSession(backend=BinaryBackend(path), verbose=False) as sesn:
+        sesn.enable_aggregates([10.0])
+        sesn.add_entries("a", np.arange(100.0), np.arange(100.0))
+        sesn.add_entry(b=1.0)
+        sesn.add_entries("o", [5.0, 1.0, 3.0], [50.0, 10.0, 30.0])
+        sesn.add_group_entries("g", [5.0, 1.0], x=[1.0, 2.0])
+        sesn.set_dataset_compression("img", "zlib")
+        sesn.add_dataset(img=np.zeros(5))
+        sesn.save_parameter(c=[1, 2])
+        assert sesn.logged_last_values()["a"] == (99.0, 99.0)
+        with pytest.raises(NotImplementedError):
+            sesn.enable_log_blocks()
+        # text values are rejected before anything is logged
+        with pytest.raises(ValueError):
+            sesn.add_entry(b=2.0, state="on")
+        assert sesn.logged_last_values()["b"][1] == 1.0
+        assert "state" not in sesn.logged_last_values()
+    with open(os.path.join(path, "log", "a.f8"), "ab") as f:
+        f.write(b"\0" * 5)
+    with open(os.path.join(path, "datasets", "img.rec"), "rb") as f:
+        assert b"zlib" in f.read()
+    with AsyncSession(backend=BinaryBackend(path), verbose=False) as sesn:
+        assert sesn.logged_variables() == {"a", "b", "o", "x"}
+        assert sesn.logged_first_values()["o"] == (1.0, 10.0)
+        assert sesn.logged_last_values()["o"] == (5.0, 50.0)
+        t, n, vmin, vmax, vmean = sesn.logged_data_aggregate("a", 10.0)
+        assert t.tolist() == list(range(0, 100, 10)) and (n == 10).all()
+        assert vmax[-1] == 99.0 and vmean[0] == 4.5
+        t, v = sesn.logged_data_range("a", 10, 89, max_points=20)
+        assert t.size <= 20 and v.max() == 89
+        t, v = sesn.logged_data_range("x")
+        assert t.tolist() == [1.0, 5.0] and v.tolist() == [2.0, 1.0]
+        with pytest.raises(ValueError):
+            sesn.add_entry(x=1.0)
+        assert sesn.logged_data_fromtimestamp("a", 97.0)[1].tolist() == [98.0, 99.0]
+        assert sesn.logged_last_values()["a"] == (99.0, 99.0)
+        assert (sesn.dataset("img") == 0).all()
+        assert sesn.parameter("c") == [1, 2]
+        assert sesn.t0 > 0
@@ -25,6 +25,24 @@ from pymanip.asyncsession import AsyncSession
 from pymanip.mytime import dateformat
 
 
+def plot_logged_variable(t, vardata, varname, title):
+    """
+    Plots a logged variable against its epoch timestamps, with date ticks
+    """
+    fig = plt.figure()
+    xtick_locator = AutoDateLocator()
+    xtick_formatter = AutoDateFormatter(xtick_locator)
+    ax = plt.axes()
+    ax.xaxis.set_major_locator(xtick_locator)
+    ax.xaxis.set_major_formatter(xtick_formatter)
+    ax.plot(epoch2num(t), vardata, "o-")
+    plt.setp(ax.xaxis.get_majorticklabels(), rotation=70)
+    fig.subplots_adjust(bottom=0.2)
+    plt.ylabel(varname)
+    plt.title(title)
+    plt.show()
+
+
 def manip_info(sessionName, quiet, line_to_print, var_to_plot):
     """
     This function prints information about a session, and optionally
@@ -68,6 +86,15 @@ def manip_info(sessionName, quiet, line_to_print, var_to_plot):
                 for ds in ds_names:
                     print(ds)
                 print()
+
+            if var_to_plot is not None:
+                if var_to_plot not in last_values:
+                    print("Variable", var_to_plot, "does not exist!")
+                    sys.exit(1)
+                # only fetch what can be displayed
+                t, vardata = sesn.logged_data_range(var_to_plot, max_points=5000)
+        if var_to_plot is not None:
+            plot_logged_variable(t, vardata, var_to_plot, sessionName)
         return
 
     if sessionName.endswith(".hdf5"):
@@ -96,25 +123,50 @@ def manip_info(sessionName, quiet, line_to_print, var_to_plot):
         MI.describe()
     if var_to_plot is not None:
         if var_to_plot in MI.log_variable_list():
-            t = epoch2num(MI.log("t"))
-            vardata = MI.log(var_to_plot)
-            fig = plt.figure()
-            xtick_locator = AutoDateLocator()
-            xtick_formatter = AutoDateFormatter(xtick_locator)
-            ax = plt.axes()
-            ax.xaxis.set_major_locator(xtick_locator)
-            ax.xaxis.set_major_formatter(xtick_formatter)
-            ax.plot(t, vardata, "o-")
-            plt.setp(ax.xaxis.get_majorticklabels(), rotation=70)
-            fig.subplots_adjust(bottom=0.2)
-            plt.ylabel(var_to_plot)
-            plt.title(sessionName)
-            plt.show()
+            plot_logged_variable(
+                MI.log("t"), MI.log(var_to_plot), var_to_plot, sessionName
+            )
         else:
             print("Variable", var_to_plot, "does not exist!")
             sys.exit(1)
 
 
+def parse_duration(duration):
+    """
+    Converts a duration such as "90", "30s", "15m", "12h" or "30d"
+    into seconds.
+    """
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    duration = str(duration).strip()
+    if duration[-1:] in units:
+        return float(duration[:-1]) * units[duration[-1]]
+    return float(duration)
+
+
+def compact_session(sessionName, max_age, bucket, keep_datasets, vacuum):
+    """
+    This function compacts an asynchroneous session database, see
+    AsyncSession.compact.
+
+    It can be accessed from the CLI tool
+    """
+
+    if sessionName.endswith(".db"):
+        sessionName = sessionName[:-3]
+    if not os.path.exists(sessionName + ".db"):
+        print(sessionName + ".db", "does not exist!")
+        sys.exit(1)
+    size_before = os.path.getsize(sessionName + ".db")
+    with AsyncSession(sessionName, verbose=False) as sesn:
+        sesn.compact(max_age, bucket, keep_datasets, vacuum)
+    size_after = os.path.getsize(sessionName + ".db")
+    print(
+        "{:}.db: {:.1f} MB -> {:.1f} MB".format(
+            sessionName, size_before / 2 ** 20, size_after / 2 ** 20
+        )
+    )
+
+
 def check_hdf(acqName, variable_to_plot):
     """
     This functions checks that the .dat file and the .hdf5 file of
@@ -20,6 +20,7 @@ setup(
     author_email="julien.salort@ens-lyon.fr",
     license="CeCILL-B",
     packages=["pymanip"],
+    python_requires=">=3.7",
     install_requires=[
         "h5py",
         "clint",